@@ -1,20 +1,16 @@
 import numpy as np
-import sys
-
-# 尝试导入音频库，优先使用sounddevice
-try:
-    import sounddevice as sd
-    AUDIO_METHOD = "sounddevice"
-except ImportError:
-    try:
-        import simpleaudio as sa
-        AUDIO_METHOD = "simpleaudio"
-    except ImportError:
-        pass
-        sys.exit(1)
+import re
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
 
 SAMPLE_RATE = 44_100
 VOLUME = 0.2
+ENVELOPE_START = 1.0
+ENVELOPE_END = 0.2
+# 音符首尾的线性淡入淡出（秒）：音符在边界处从 0 起、回到 0，前后音符衔接时不会跳变
+RAMP_SECONDS = 0.005
+BLOCK_SIZE = 2048
 
 NOTE_FREQ = {
     "C4": 261.63, "D4": 293.66, "E4": 329.63, "F4": 349.23,
@@ -29,33 +25,213 @@ MELODY = [
     ("F5", 0.75), ("F5", 0.25), ("E5", 1), ("C5", 1), ("D5", 1), ("C5", 2)
 ]
 
+_NOTE_NAME = re.compile(r"([A-Ga-g])([#b]?)(-?\d+)$")
+_SEMITONES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+def note_number(note: str) -> int:
+    """音名转 MIDI 音符号（C4 = 60）"""
+    match = _NOTE_NAME.match(note)
+    if not match:
+        raise ValueError(f"无法识别的音名: {note}")
+    letter, accidental, octave = match.groups()
+    semitone = _SEMITONES[letter.upper()] + {"#": 1, "b": -1, "": 0}[accidental]
+    return 12 * (int(octave) + 1) + semitone
+
+def midi_frequency(number):
+    """十二平均律（A4 = 440 Hz），接受标量或数组"""
+    return 440.0 * 2 ** ((np.asarray(number, dtype=np.float64) - 69) / 12)
+
+def note_frequency(note: str) -> float:
+    """音名转频率：NOTE_FREQ 中有的直接查表，其余按十二平均律计算"""
+    if note in NOTE_FREQ:
+        return NOTE_FREQ[note]
+    return float(midi_frequency(note_number(note)))
+
+class SongEvents(NamedTuple):
+    """编译后的旋律：每个音符的起始采样、长度、频率（0 为休止）和起始相位"""
+    start: np.ndarray
+    length: np.ndarray
+    end: np.ndarray
+    freq: np.ndarray
+    phase: np.ndarray
+    sample_rate: int
+    total: int
+
+class WaveformCache:
+    """按字节预算做 LRU 淘汰的音符波形缓存，缓存的数组都是只读的"""
+    
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key, build):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        
+        value = build()
+        value.flags.writeable = False
+        
+        with self._lock:
+            if key not in self._entries and value.nbytes <= self.max_bytes:
+                self._entries[key] = value
+                self._bytes += value.nbytes
+                self._evict()
+        return value
+    
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+    
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+    
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.evictions += 1
+
+waveform_cache = WaveformCache()
+
+def ramp_samples(length, sample_rate: int):
+    """每个音符淡入、淡出各占的采样数：不超过音符长度的一半，至少为 1；接受标量或数组"""
+    return np.maximum(np.minimum(int(round(RAMP_SECONDS * sample_rate)), np.asarray(length) // 2), 1)
+
+def envelope(n: int, sample_rate: int = None, lo: int = 0, hi: int = None) -> np.ndarray:
+    """长度为 n 的音符包络在 [lo, hi) 上的 float64 取值（不含音量）
+    
+    从 ENVELOPE_START 线性衰减到 ENVELOPE_END，再乘以首尾各 ramp_samples 个采样的线性淡入淡出，
+    第一个和最后一个采样为 0。
+    """
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    hi = n if hi is None else hi
+    j = np.arange(lo, hi, dtype=np.float64)
+    ramp = int(ramp_samples(n, sample_rate))
+    step = (ENVELOPE_END - ENVELOPE_START) / max(n - 1, 1)
+    result = ENVELOPE_START + step * j
+    result *= np.clip(np.minimum(j, n - 1 - j) / ramp, 0.0, 1.0)
+    return result
+
+def note_waveform(freq: float, n: int, sample_rate: int = None) -> np.ndarray:
+    """返回形状为 (2, n) 的只读数组：带包络的 sin 与 cos 分量
+    
+    任意起始相位 p 的音符都可以由 sin·cos(p) + cos·sin(p) 合成，
+    所以同一个 (音高, 时值) 在歌曲里重复出现时只需计算一次。
+    """
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    key = (freq, n, sample_rate, ENVELOPE_START, ENVELOPE_END, RAMP_SECONDS, VOLUME)
+    
+    def build():
+        x = 2 * np.pi * freq / sample_rate * np.arange(n)
+        amplitude = envelope(n, sample_rate) * VOLUME
+        table = np.empty((2, n), dtype=np.float32)
+        np.multiply(np.sin(x), amplitude, out=table[0])
+        np.multiply(np.cos(x), amplitude, out=table[1])
+        return table
+    
+    return waveform_cache.get(key, build)
+
 def synth_note(freq: float, duration: float) -> np.ndarray:
-    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
-    tone = np.sin(2 * np.pi * freq * t)
-    envelope = np.linspace(1, 0.2, tone.size)  # 简单衰减
-    return (tone * envelope * VOLUME).astype(np.float32)
-
-def play_audio(song: np.ndarray):
-    try:
-        if AUDIO_METHOD == "sounddevice":
-            sd.play(song, SAMPLE_RATE)
-            sd.wait()
-        else:
-            audio = np.int16(song * 32767)
-            play_obj = sa.play_buffer(audio, 1, 2, SAMPLE_RATE)
-            play_obj.wait_done()
-        return True
-    except Exception as e:
-        pass
-        return False
-
-def generate_song(bpm: int) -> np.ndarray:
+    return note_waveform(freq, int(SAMPLE_RATE * duration))[0]
+
+def compile_melody(bpm: int, melody=None, sample_rate: int = None, transpose: float = 0) -> SongEvents:
+    """把旋律一次性编译成采样偏移事件，相位在音符之间连续累加
+    
+    transpose 为移调的半音数（十二平均律）。
+    """
+    melody = MELODY if melody is None else melody
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
     beat = 60 / bpm
     
-    song = np.concatenate([
-        synth_note(NOTE_FREQ[note], beat * beats)
-        if note != "REST" else np.zeros(int(SAMPLE_RATE * beat * beats))
-        for note, beats in MELODY
-    ])
+    length = np.array([int(sample_rate * beat * beats) for _, beats in melody], dtype=np.int64)
+    freq = np.array([0.0 if note == "REST" else note_frequency(note) for note, _ in melody])
+    if transpose:
+        freq *= 2 ** (transpose / 12)
+    end = np.cumsum(length)
+    start = end - length
     
-    return song 
\ No newline at end of file
+    # 每个音符结束时的相位就是下一个音符的起始相位；包络在音符首尾淡入淡出到 0，接缝处不会爆音
+    advance = 2 * np.pi * freq / sample_rate * length
+    phase = np.mod(np.cumsum(advance) - advance, 2 * np.pi)
+    
+    total = int(end[-1]) if end.size else 0
+    return SongEvents(start, length, end, freq, phase, sample_rate, total)
+
+def render_events(events: SongEvents, out: np.ndarray, offset: int = 0) -> np.ndarray:
+    """把事件直接写入预分配的 out，out[0] 对应歌曲的第 offset 个采样"""
+    end = offset + out.size
+    first = np.searchsorted(events.end, offset, side="right")
+    last = np.searchsorted(events.start, end, side="left")
+    
+    # 临时缓冲区只与单个音符（或窗口）一样长，与歌曲总长度无关
+    span = int(min(events.length[first:last].max(initial=0), out.size))
+    scratch = np.empty(span, dtype=np.float32)
+    
+    for i in range(first, last):
+        note_start = int(events.start[i])
+        note_len = int(events.length[i])
+        lo = max(note_start, offset)
+        hi = min(note_start + note_len, end)
+        seg = out[lo - offset:hi - offset]
+        
+        if events.freq[i] == 0:
+            seg[:] = 0
+            continue
+        
+        # sin(x + p) = sin(x)·cos(p) + cos(x)·sin(p)
+        table = note_waveform(float(events.freq[i]), note_len, events.sample_rate)
+        a, b = lo - note_start, hi - note_start
+        phase = events.phase[i]
+        np.multiply(table[0, a:b], np.cos(phase), out=seg)
+        tmp = scratch[:b - a]
+        np.multiply(table[1, a:b], np.sin(phase), out=tmp)
+        seg += tmp
+    
+    return out
+
+def iter_song_blocks(bpm: int, block_size: int = None, sample_rate: int = None, transpose: float = 0,
+                     timbre: str = None):
+    """逐块渲染歌曲，内存占用只与块大小有关
+    
+    timbre 为 None 时使用正弦路径；否则用 wavetable 中该音色的波表振荡器渲染。
+    """
+    block_size = BLOCK_SIZE if block_size is None else block_size
+    events = compile_melody(bpm, sample_rate=sample_rate, transpose=transpose)
+    render = render_events
+    if timbre is not None:
+        import wavetable
+        render = lambda events, out, offset: wavetable.render_events(events, out, offset, timbre)
+    
+    for offset in range(0, events.total, block_size):
+        block = np.empty(min(block_size, events.total - offset), dtype=np.float32)
+        yield render(events, block, offset)
+
+def generate_song(bpm: int, sample_rate: int = None) -> np.ndarray:
+    events = compile_melody(bpm, sample_rate=sample_rate)
+    song = np.empty(events.total, dtype=np.float32)
+    return render_events(events, song) 
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+底图加载
+路径只解析一次；目标尺寸更小时按比例缩小解码；解码后的 RGB 像素保存为 .npy，
+之后的启动和并行的工作进程都可以直接内存映射，不再解码 PNG
+numpy 和 PIL 在真正解码或读取像素时才导入，只查找底图路径的调用方不必加载它们
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+
+import tracing
+from config import get_cache_dir, prune_cache_dir
+
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+_base_image_path = None
+
+def get_base_image_paths():
+    """底图的候选路径 - 多种路径查找策略"""
+    base_image_paths = []
+    
+    # PyInstaller打包后的路径处理
+    if hasattr(sys, '_MEIPASS'):
+        # 打包后的临时目录
+        base_image_paths.append(os.path.join(sys._MEIPASS, "wallpaper_basic.png"))
+    
+    # 当前工作目录
+    base_image_paths.append("wallpaper_basic.png")
+    
+    # 脚本所在目录
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    base_image_paths.append(os.path.join(script_dir, "wallpaper_basic.png"))
+    
+    # 可执行文件所在目录（对于打包后的exe）
+    if hasattr(sys, 'frozen'):
+        exe_dir = os.path.dirname(sys.executable)
+        base_image_paths.append(os.path.join(exe_dir, "wallpaper_basic.png"))
+    
+    return base_image_paths
+
+def find_base_image():
+    """返回第一个存在的底图绝对路径，找不到时返回 None；结果在进程内只解析一次"""
+    global _base_image_path
+    if _base_image_path is None or not os.path.exists(_base_image_path):
+        _base_image_path = None
+        for path in get_base_image_paths():
+            if os.path.exists(path):
+                _base_image_path = os.path.abspath(path)
+                break
+    return _base_image_path
+
+def _fit_size(src_size, target_size):
+    """按“填满”方式缩放：返回缩放后的尺寸，保证两边都不小于目标"""
+    scale = max(target_size[0] / src_size[0], target_size[1] / src_size[1])
+    return (max(target_size[0], round(src_size[0] * scale)),
+            max(target_size[1], round(src_size[1] * scale)))
+
+@tracing.traced("wallpaper.decode_base")
+def decode_base_image(path: str, target_size=None):
+    """解码底图为 RGB 的 PIL 图像；给定 target_size 时缩放并居中裁剪到该尺寸"""
+    from PIL import Image
+    
+    image = Image.open(path)
+    
+    if target_size is not None:
+        target_size = tuple(target_size)
+        # JPEG 等格式可以在解码阶段直接按 1/2、1/4、1/8 缩小
+        image.draft("RGB", _fit_size(image.size, target_size))
+    
+    image = image.convert("RGB")
+    
+    if target_size is not None and image.size != target_size:
+        fit = _fit_size(image.size, target_size)
+        # 先用整数倍的盒式缩小去掉大部分像素，再做精确缩放
+        factor = min(image.size[0] // fit[0], image.size[1] // fit[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+        if image.size != fit:
+            image = image.resize(fit, Image.LANCZOS)
+        left = (fit[0] - target_size[0]) // 2
+        top = (fit[1] - target_size[1]) // 2
+        image = image.crop((left, top, left + target_size[0], top + target_size[1]))
+    
+    return image
+
+def _cache_path(path: str, target_size) -> str:
+    st = os.stat(path)
+    stamp = f"{path}|{st.st_mtime_ns}|{st.st_size}|{target_size}"
+    key = hashlib.sha256(stamp.encode("utf-8")).hexdigest()
+    return os.path.join(get_cache_dir("images"), f"{key}.npy")
+
+def load_base_pixels(target_size=None):
+    """返回底图的 RGB 像素（只读内存映射），找不到底图时返回 None"""
+    import numpy as np
+    
+    path = find_base_image()
+    if path is None:
+        return None
+    target_size = tuple(target_size) if target_size is not None else None
+    
+    try:
+        cache_path = _cache_path(path, target_size)
+        pixels = np.load(cache_path, mmap_mode="r")
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return pixels
+    except (ValueError, OSError):
+        pass
+    
+    pixels = np.asarray(decode_base_image(path, target_size))
+    
+    try:
+        cache_path = _cache_path(path, target_size)
+        cache_dir = os.path.dirname(cache_path)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    except OSError:
+        # 缓存目录不可用时直接使用解码结果
+        return pixels
+    
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, pixels)
+        os.replace(tmp_path, cache_path)
+        prune_cache_dir(cache_dir, ".npy", MAX_CACHE_BYTES)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return pixels
+
+def load_base_image(target_size=None):
+    """返回可绘制的底图副本，找不到底图时返回 None"""
+    import numpy as np
+    from PIL import Image
+    
+    try:
+        pixels = load_base_pixels(target_size)
+    except Exception as e:
+        tracing.error("wallpaper.base_image", e)
+        return None
+    if pixels is None:
+        return None
+    return Image.fromarray(np.ascontiguousarray(pixels), "RGB")
+
+def benchmark(repeat: int = 3):
+    """对比直接解码、缩小解码和读取像素缓存的耗时与像素内存"""
+    import time
+    from PIL import Image
+    
+    path = find_base_image()
+    if path is None:
+        print("找不到底图")
+        return {}
+    
+    with Image.open(path) as image:
+        native = image.size
+    half = (native[0] // 2, native[1] // 2)
+    
+    def full_decode():
+        with Image.open(path) as image:
+            image.load()
+            return image.copy()
+    
+    cases = {
+        "Image.open 原尺寸": full_decode,
+        "缩小解码 1/2": lambda: decode_base_image(path, half),
+        "像素缓存 原尺寸": lambda: load_base_image(),
+        "像素缓存 1/2": lambda: load_base_image(half),
+    }
+    load_base_pixels()
+    load_base_pixels(half)
+    
+    results = {}
+    for name, func in cases.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            image = func()
+            best = min(best, time.perf_counter() - start)
+        pixel_bytes = image.size[0] * image.size[1] * len(image.getbands())
+        results[name] = {"seconds": best, "pixel_bytes": pixel_bytes}
+        print(f"{name}: {best * 1000:.1f}ms  {pixel_bytes / 1e6:.1f}MB  {image.size}")
+    return results
+
+if __name__ == "__main__":
+    benchmark()
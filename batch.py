@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+批量生成壁纸
+从 CSV / JSONL 读取收件人和祝福语，在进程池中并行渲染，结果逐条写入输出目录和清单文件
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+import encoders
+from base_image import load_base_pixels
+from config import default_workers, get_setting
+from gradient import create_gradient
+from screen import parse_size
+from wallpaper import FALLBACK_GRADIENT, FONT_SIZE, draw_message, find_font_path, load_font
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 工作进程内的共享状态：底图像素（内存映射）和已加载的字体
+_worker = {}
+
+def read_recipients(path: str, template: str = None):
+    """读取收件人列表，返回 [{"name": ..., "message": ...}, ...]
+    
+    CSV 需要表头；JSONL 每行一个对象。没有 message 字段时用 template.format(name=...) 生成。
+    """
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    
+    recipients = []
+    for row in rows:
+        name = (row.get("name") or row.get("recipient") or "").strip()
+        message = (row.get("message") or "").strip()
+        if not message and template:
+            message = template.format(name=name)
+        recipients.append({"name": name, "message": message})
+    return recipients
+
+def _slug(name: str) -> str:
+    slug = re.sub(r"[^\w\-]+", "_", name, flags=re.UNICODE).strip("_")
+    return slug[:40] or "recipient"
+
+def _init_worker(size):
+    # 父进程已经写好了像素缓存，这里只是映射同一个文件，各进程共享页缓存
+    _worker["pixels"] = load_base_pixels(size)
+    _worker["size"] = size
+    _worker["fonts"] = {}
+
+def _get_font(message: str):
+    font_path = find_font_path(message)
+    font = _worker["fonts"].get(font_path)
+    if font is None:
+        font = _worker["fonts"][font_path] = load_font(FONT_SIZE, message)
+    return font
+
+def _render_one(index: int, message: str, output_path: str, profile: str):
+    start = time.perf_counter()
+    pixels = _worker["pixels"]
+    if pixels is not None:
+        image = Image.fromarray(np.array(pixels), "RGB")
+    else:
+        image = create_gradient(_worker["size"] or (1920, 1080), FALLBACK_GRADIENT)
+    draw_message(image, message, _get_font(message))
+    encoders.save(image, output_path, profile)
+    return index, time.perf_counter() - start
+
+def run_batch(recipients, output_dir: str, workers: int = None, profile: str = None, size=None):
+    """并行渲染全部壁纸，返回汇总信息；每完成一项就向清单追加一行"""
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or default_workers()
+    profile = get_setting("encoder_profile") if profile is None else profile
+    ext = encoders.extension(profile)
+    
+    # 先在父进程中解码一次底图，工作进程直接映射缓存文件
+    load_base_pixels(size)
+    
+    started = time.perf_counter()
+    succeeded = failed = 0
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    
+    with open(manifest_path, "w", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(size,)) as pool:
+        futures = {}
+        for index, item in enumerate(recipients):
+            output_path = os.path.join(output_dir, f"{index:05d}_{_slug(item['name'])}{ext}")
+            future = pool.submit(_render_one, index, item["message"], output_path, profile)
+            futures[future] = (index, item, output_path)
+        
+        for future in as_completed(futures):
+            index, item, output_path = futures[future]
+            record = {"index": index, "name": item["name"], "message": item["message"]}
+            try:
+                _, seconds = future.result()
+                record.update(status="ok", path=output_path, seconds=round(seconds, 4))
+                succeeded += 1
+            except Exception as e:
+                record.update(status="error", error=f"{type(e).__name__}: {e}")
+                failed += 1
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.flush()
+    
+    elapsed = time.perf_counter() - started
+    total = succeeded + failed
+    return {
+        "total": total,
+        "succeeded": succeeded,
+        "failed": failed,
+        "workers": workers,
+        "seconds": elapsed,
+        "images_per_second": total / elapsed if elapsed > 0 else 0.0,
+        "manifest": manifest_path,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成生日壁纸")
+    parser.add_argument("recipients", help="CSV（带表头）或 JSONL 文件，字段 name、message")
+    parser.add_argument("-o", "--output", default="wallpapers", help="输出目录")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作进程数，默认取配置项 workers，未设置时为 CPU 核数")
+    parser.add_argument("--profile", default=None, choices=sorted(encoders.PROFILES), help="编码档位，默认取配置项 encoder_profile")
+    parser.add_argument("--size", default=None, help="输出尺寸，如 1920x1080，默认底图原尺寸")
+    parser.add_argument("--template", default=None, help="缺少 message 时使用的模板，如 \"{name}，生日快乐！\"")
+    args = parser.parse_args(argv)
+    
+    size = parse_size(args.size) if args.size else None
+    recipients = read_recipients(args.recipients, args.template)
+    summary = run_batch(recipients, args.output, args.workers, args.profile, size)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return summary["failed"] == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+基准测试
+覆盖音频合成（bpm、旋律长度、采样率）、壁纸渲染（分辨率、字体）、读取配置，
+以及把音频设备和设置壁纸替换成空实现后的端到端 main() 运行；
+结果写成 JSON，--compare 与保存的基线对比并标出变慢的项目
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 默认参数附近逐个维度扫描，避免组合爆炸
+BPMS = (60, 90, 120, 180)
+MELODY_COPIES = (1, 4, 16)
+SAMPLE_RATES = (22_050, 44_100, 48_000, 96_000)
+RESOLUTIONS = ((1280, 720), (1920, 1080), (2560, 1440), (3840, 2160))
+MESSAGE = "生日快乐！Happy Birthday!"
+GROUPS = ("synth", "wallpaper", "config", "e2e")
+
+# 比基线慢这么多（比例）且绝对差值超过噪声下限时判为回退
+THRESHOLD = 0.10
+NOISE_FLOOR = 0.001
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """运行 repeat 次，返回最快和中位数耗时（秒）；setup 在每次计时前执行，不计入耗时"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times)}
+
+def bench_synth(repeat: int) -> dict:
+    import numpy as np
+    import audio
+    
+    def render(bpm, copies, sample_rate):
+        events = audio.compile_melody(bpm, audio.MELODY * copies, sample_rate)
+        audio.render_events(events, np.empty(events.total, dtype=np.float32))
+    
+    cases = [("bpm", bpm, 1, audio.SAMPLE_RATE) for bpm in BPMS]
+    cases += [("length", 90, copies, audio.SAMPLE_RATE) for copies in MELODY_COPIES]
+    cases += [("sample_rate", 90, 1, rate) for rate in SAMPLE_RATES]
+    
+    results = {}
+    for axis, bpm, copies, sample_rate in cases:
+        name = f"synth/{axis}/bpm={bpm},length={copies}x,rate={sample_rate}"
+        if name in results:
+            continue
+        # 每次都清空波形缓存，测的是冷渲染
+        timing = measure(lambda: render(bpm, copies, sample_rate), repeat, audio.waveform_cache.clear)
+        results[name] = dict(timing, params={"bpm": bpm, "melody_copies": copies, "sample_rate": sample_rate})
+    
+    timing = measure(lambda: audio.synth_note(440.0, 1.0), repeat, audio.waveform_cache.clear)
+    results["synth/synth_note/1s"] = dict(timing, params={"freq": 440.0, "duration": 1.0})
+    return results
+
+def _available_fonts():
+    from wallpaper import get_system_fonts
+    return [path for path in get_system_fonts() if os.path.exists(path)]
+
+def bench_wallpaper(repeat: int) -> dict:
+    from PIL import ImageFont
+    
+    import encoders
+    from base_image import load_base_image
+    from gradient import create_gradient
+    from wallpaper import FALLBACK_GRADIENT, FONT_SIZE, create_wallpaper_image, draw_message
+    
+    results = {}
+    for size in RESOLUTIONS:
+        label = f"{size[0]}x{size[1]}"
+        
+        def render():
+            encoders.encode(create_wallpaper_image(MESSAGE, size))
+        
+        # 第一次运行会写入底图像素缓存，之后测的是缓存命中后的绘制和编码
+        render()
+        results[f"wallpaper/resolution/{label}"] = dict(
+            measure(render, repeat), params={"size": list(size), "profile": encoders.DEFAULT_PROFILE})
+    
+    size = (1920, 1080)
+    # 与 create_wallpaper_image 一样，找不到底图时在渐变背景上绘制
+    base = load_base_image(size)
+    background = "base_image"
+    if base is None:
+        base = create_gradient(size, FALLBACK_GRADIENT)
+        background = "fallback_gradient"
+    fonts = [(os.path.basename(path), lambda path=path: ImageFont.truetype(path, FONT_SIZE))
+             for path in _available_fonts()]
+    fonts.append(("default", ImageFont.load_default))
+    for name, load in fonts:
+        font = load()
+        
+        def draw():
+            draw_message(base.copy(), MESSAGE, font)
+        
+        results[f"wallpaper/font/{name}"] = dict(
+            measure(draw, repeat), params={"font": name, "size": list(size), "background": background})
+        results[f"wallpaper/font_load/{name}"] = dict(measure(load, repeat), params={"font": name})
+    return results
+
+def bench_config(repeat: int) -> dict:
+    from config import get_config
+    repeat = max(repeat, 20)
+    return {
+        "config/get_config": dict(measure(get_config, repeat), params={"cached": True}),
+        "config/get_config/reload": dict(measure(lambda: get_config(reload=True), repeat), params={"cached": False}),
+    }
+
+def _stubbed_main():
+    """子进程入口：播放后端换成只消费数据块的空实现，设置壁纸换成空操作，然后运行 main()"""
+    import playback
+    import wallpaper
+    from audio import BLOCK_SIZE, SAMPLE_RATE
+
+    class NullBackend:
+        name = "null"
+        
+        def negotiate_format(self, refresh=False):
+            return playback.AudioFormat(SAMPLE_RATE, "float32", "null")
+        
+        def block_size(self, sample_rate):
+            return BLOCK_SIZE
+        
+        def play_stream(self, blocks, sample_rate, block_size, dtype):
+            for _ in blocks:
+                pass
+        
+        def play(self, song, sample_rate):
+            pass
+    
+    playback.BACKENDS.clear()
+    playback.register_backend("null", NullBackend)
+    wallpaper.set_wallpaper = lambda *args, **kwargs: True
+    
+    import main
+    start = time.perf_counter()
+    timings = main.run_pipeline(main.get_config())
+    timings["main"] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+def bench_e2e(repeat: int) -> dict:
+    """每次都是新进程：冷缓存（空缓存目录）和热缓存（同一目录再跑一次）各测 repeat 次"""
+    def run(cache_dir):
+        env = dict(os.environ, BIRTHDAY_CACHE_DIR=cache_dir)
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--stubbed-main"],
+            env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        wall = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"端到端运行失败:\n{result.stderr[-2000:]}")
+        return wall, json.loads(result.stdout.strip().splitlines()[-1])
+    
+    results = {}
+    for label in ("cold", "warm"):
+        walls, stages = [], []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                wall, timings = run(cache_dir)
+                if label == "warm":
+                    wall, timings = run(cache_dir)
+            walls.append(wall)
+            stages.append(timings)
+        best = min(range(repeat), key=lambda i: walls[i])
+        results[f"e2e/main/{label}"] = {
+            "best": walls[best],
+            "median": statistics.median(walls),
+            "params": {"cache": label},
+            "stages": stages[best],
+        }
+    return results
+
+BENCHMARKS = {
+    "synth": bench_synth,
+    "wallpaper": bench_wallpaper,
+    "config": bench_config,
+    "e2e": bench_e2e,
+}
+
+def run(groups=GROUPS, repeat: int = 5) -> dict:
+    import numpy as np
+    import PIL
+    
+    results = {}
+    for group in groups:
+        results.update(BENCHMARKS[group](repeat))
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """按最快耗时逐项对比，返回 [(名称, 基线秒数, 当前秒数, 比值, 状态), ...]"""
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            rows.append((name, None, result["best"], None, "new"))
+            continue
+        ratio = result["best"] / base["best"] if base["best"] > 0 else float("inf")
+        delta = result["best"] - base["best"]
+        if ratio > 1 + threshold and delta > NOISE_FLOOR:
+            status = "regression"
+        elif ratio < 1 - threshold and -delta > NOISE_FLOOR:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, base["best"], result["best"], ratio, status))
+    return rows
+
+def _print_compare(rows):
+    marks = {"regression": "变慢", "improved": "变快", "ok": "", "new": "新增"}
+    for name, base, now, ratio, status in rows:
+        before = f"{base * 1000:9.2f}ms" if base is not None else " " * 11
+        change = f"{ratio:6.2f}x" if ratio is not None else " " * 7
+        print(f"{name:<56} {before} -> {now * 1000:9.2f}ms {change} {marks[status]}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成、壁纸和端到端启动的基准测试")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"逗号分隔的分组: {','.join(GROUPS)}")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="每项的重复次数，取最快值")
+    parser.add_argument("-o", "--output", default=None, help="把结果写入这个 JSON 文件（可作为基线）")
+    parser.add_argument("--compare", default=None, help="与基线 JSON 对比，有回退时返回失败")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="判为回退的相对变慢比例")
+    parser.add_argument("--stubbed-main", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    
+    if args.stubbed_main:
+        _stubbed_main()
+        return True
+    
+    groups = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的分组: {', '.join(unknown)}")
+    
+    # 使用临时缓存目录，既不读取也不污染用户的缓存
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["BIRTHDAY_CACHE_DIR"] = cache_dir
+        report = run(groups, args.repeat)
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        _print_compare(rows)
+        return not any(status == "regression" for *_, status in rows)
+    
+    if not args.output:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -1,8 +1,140 @@
+"""
+配置
+config.json 解析后按文件的 (mtime, 大小) 缓存，文件没变时 get_config() 只多一次 stat；
+读取时按 SCHEMA 校验并补全默认值。文件无法解析时记录错误并依次退回下一个候选文件、默认配置；
+个别项不合法时只把这些项恢复为默认值。只有 strict=True 时才整个文件失败并抛出 ConfigError。
+常驻进程可以用 watch_config() 在文件修改后热加载
+"""
+
 import json
 import os
+import platform
 import sys
+import threading
+import time
+
+import tracing
+
+DEFAULT_MESSAGE = "🎉 生日快乐歌播放完成！Happy Birthday! 🎂"
+
+class ConfigError(ValueError):
+    """配置文件无法解析，或其中的取值不合法"""
+
+def _integer(low: int, high: int):
+    def check(value):
+        # bool 是 int 的子类，true/false 不能当作数字
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"应为整数，实际是 {value!r}")
+        if not low <= value <= high:
+            raise ValueError(f"应在 {low} 到 {high} 之间，实际是 {value}")
+        return value
+    return check
+
+def _seconds(low: float, high: float):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"应为秒数，实际是 {value!r}")
+        if not low <= value <= high:
+            raise ValueError(f"应在 {low} 到 {high} 秒之间，实际是 {value}")
+        return float(value)
+    return check
+
+def _string(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"应为非空字符串，实际是 {value!r}")
+    return value
+
+def _optional(check):
+    def optional(value):
+        return None if value is None else check(value)
+    return optional
+
+def _encoder_profile(value):
+    import encoders
+    if value not in encoders.PROFILES:
+        raise ValueError(f"未知的编码档位 {value!r}（可选: {', '.join(encoders.PROFILES)}）")
+    return value
+
+def _screen_size(value):
+    from screen import parse_size
+    size = parse_size(value)
+    if size is None:
+        raise ValueError(f"应为 [宽, 高] 或 \"宽x高\"，实际是 {value!r}")
+    return size
+
+def _cache_dirs(value):
+    if not isinstance(value, dict):
+        raise ValueError(f"应为 {{缓存名: 目录}} 对象，实际是 {value!r}")
+    for name, path in value.items():
+        _string(path)
+    return dict(value)
 
-def get_config():
+def _trace(value):
+    if not isinstance(value, (bool, int, str)):
+        raise ValueError(f"应为 true/false 或输出路径，实际是 {value!r}")
+    return value
+
+# 配置项 -> (默认值, 校验函数)；校验函数返回规范化后的值，不合法时抛出 ValueError
+SCHEMA = {
+    "bpm": (90, _integer(20, 400)),
+    "message": (DEFAULT_MESSAGE, _string),
+    # 以下为性能相关设置，为空时使用设备协商或各模块自己的默认值
+    "sample_rate": (None, _optional(_integer(8_000, 384_000))),
+    "block_size": (None, _optional(_integer(64, 65_536))),
+    "workers": (None, _optional(_integer(1, 256))),
+    "cache_dir": (None, _optional(_string)),
+    "cache_dirs": ({}, _cache_dirs),
+    "encoder_profile": (None, _optional(_encoder_profile)),
+    "screen_size": (None, _optional(_screen_size)),
+    "score": (None, _optional(_string)),
+    "trace": (None, _optional(_trace)),
+    # 生日日历（scheduler.py）：日历文件、提前预渲染的秒数、错过后仍然补放的最长秒数
+    "calendar": (None, _optional(_string)),
+    "lead_time": (300.0, _seconds(0, 7 * 24 * 3600)),
+    "missed_grace": (3600.0, _seconds(0, 7 * 24 * 3600)),
+}
+
+def default_config() -> dict:
+    return {key: (dict(default) if isinstance(default, dict) else default)
+            for key, (default, _) in SCHEMA.items()}
+
+def validate_config(raw, source: str = "config.json", strict: bool = True) -> dict:
+    """校验并补全默认值，返回新的字典；一次列出所有不合法的项。SCHEMA 以外的键原样保留
+    
+    strict 为 True 时有不合法的项就抛出 ConfigError；否则只把这些项恢复为默认值，
+    记录错误并保留其余合法的项。顶层不是 JSON 对象时总是抛出 ConfigError。
+    """
+    if not isinstance(raw, dict):
+        raise ConfigError(f"{source}: 顶层应为 JSON 对象")
+    config = default_config()
+    problems = []
+    for key, value in raw.items():
+        if key not in SCHEMA:
+            config[key] = value
+            continue
+        try:
+            config[key] = SCHEMA[key][1](value)
+        except ValueError as e:
+            problems.append(f"{key}: {e}")
+    if problems:
+        error = ConfigError(f"{source} 中的配置不合法:\n  " + "\n  ".join(problems))
+        if strict:
+            raise error
+        tracing.error("config.load", error, path=source)
+        print(f"{error}\n这些项改用默认值", file=sys.stderr)
+    return config
+
+def load_config(path: str, strict: bool = True) -> dict:
+    """读取、解析并校验指定的配置文件（不经过缓存）；strict 的含义见 validate_config"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{path}: 第 {e.lineno} 行第 {e.colno} 列无法解析: {e.msg}") from e
+    return validate_config(raw, path, strict)
+
+def get_config_paths():
+    """候选配置文件，按优先级排列：程序同目录的 config.json，打包时内嵌的 config.json"""
     # 获取程序所在目录
     if hasattr(sys, '_MEIPASS'):
         # 打包后的程序，获取可执行文件所在目录
@@ -11,22 +143,172 @@ def get_config():
         # 开发环境，使用当前脚本所在目录
         exe_dir = os.path.dirname(os.path.abspath(__file__))
     
-    # 优先读取与程序同目录的config.json
-    external_config_path = os.path.join(exe_dir, "config.json")
+    paths = [os.path.join(exe_dir, "config.json")]
+    if hasattr(sys, '_MEIPASS'):
+        paths.append(os.path.join(sys._MEIPASS, "config.json"))
+    return paths
+
+def _find_config():
+    """返回存在的候选文件及其 (mtime, 大小)：((路径, (mtime, 大小)), ...)，按优先级排列"""
+    found = []
+    for path in get_config_paths():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        found.append((path, (st.st_mtime_ns, st.st_size)))
+    return tuple(found)
+
+def _load_first(candidates):
+    """返回 (配置, 错误列表)：第一个能读取、解析的候选文件，都不行时为默认配置
+    
+    被跳过的文件和其中不合法的项都记在错误列表里；不合法的项恢复为默认值，其余的项照常使用。
+    """
+    errors = []
+    for path, _ in candidates:
+        try:
+            return load_config(path), errors
+        except ConfigError as e:
+            # 区分整个文件不可用和个别项不合法：后者保留合法的项，只是记下错误
+            try:
+                config = load_config(path, strict=False)
+            except ConfigError:
+                pass
+            else:
+                errors.append(e)
+                return config, errors
+            error = e
+        except OSError as e:
+            error = ConfigError(f"{path}: 无法读取: {e}")
+        tracing.error("config.load", error, path=path)
+        print(f"忽略配置文件 {error}", file=sys.stderr)
+        errors.append(error)
+    return default_config(), errors
+
+# 候选文件的 (路径, (mtime, 大小)) 和对应的校验结果、被跳过的文件的错误
+_cached_stamp = None
+_cached_config = None
+_cached_errors = []
+_config_lock = threading.Lock()
+
+def get_config(reload: bool = False, strict: bool = False) -> dict:
+    """返回校验过的配置（副本），文件没有变化时不重新读取；都找不到时返回默认配置
     
-    try:
-        # 尝试读取外部配置文件
-        with open(external_config_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # 外部配置文件不存在或损坏，尝试读取内嵌配置
-        if hasattr(sys, '_MEIPASS'):
-            internal_config_path = os.path.join(sys._MEIPASS, "config.json")
+    配置文件无法解析时记录错误，改用下一个候选文件或默认配置；个别项不合法时只有这些项用默认值。
+    strict 为 True 时改为抛出 ConfigError。
+    """
+    global _cached_stamp, _cached_config, _cached_errors
+    stamp = _find_config()
+    with _config_lock:
+        if reload or _cached_config is None or _cached_stamp != stamp:
+            _cached_config, _cached_errors = _load_first(stamp)
+            _cached_stamp = stamp
+        config, errors = _cached_config, _cached_errors
+    if strict and errors:
+        raise errors[0]
+    return dict(config, cache_dirs=dict(config["cache_dirs"]))
+
+def watch_config(callback, interval: float = 1.0, stop: threading.Event = None) -> threading.Thread:
+    """在后台线程每 interval 秒检查一次配置文件，变化时用新配置调用 callback(config)
+    
+    修改后的文件不合法时保留原配置，把错误打印到 stderr，等下一次修改。
+    设置 stop 事件即可结束线程。
+    """
+    stop = threading.Event() if stop is None else stop
+    
+    def run():
+        last = _find_config()
+        while not stop.wait(interval):
+            current = _find_config()
+            if current == last:
+                continue
+            last = current
             try:
-                with open(internal_config_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
+                config = get_config(strict=True)
+            except ConfigError as e:
+                print(f"配置未重新加载: {e}", file=sys.stderr)
+                continue
+            try:
+                callback(config)
+            except Exception as e:
+                print(f"配置重新加载回调出错: {e}", file=sys.stderr)
+    
+    thread = threading.Thread(target=run, name="config-watch", daemon=True)
+    thread.start()
+    return thread
+
+def get_setting(key: str):
+    """读取单个配置项；配置不合法时已退回默认值，缓存目录、进程数等不会因配置出错而不可用"""
+    return get_config()[key]
+
+def default_workers() -> int:
+    """进程池大小：配置项 workers，未设置时为 CPU 核数"""
+    return get_setting("workers") or os.cpu_count() or 1
+
+def get_cache_dir(name: str = None) -> str:
+    """获取缓存目录，不存在时自动创建
+    
+    优先级：环境变量 BIRTHDAY_CACHE_DIR > 配置项 cache_dirs 中按名字指定的目录 >
+    配置项 cache_dir > 平台默认位置。
+    """
+    base = os.environ.get("BIRTHDAY_CACHE_DIR")
+    if not base:
+        cache_dirs = get_setting("cache_dirs")
+        if name and name in cache_dirs:
+            path = os.path.expanduser(cache_dirs[name])
+            os.makedirs(path, exist_ok=True)
+            return path
+        base = get_setting("cache_dir")
+        base = base and os.path.expanduser(base)
+    if not base:
+        system = platform.system()
+        if system == "Windows":
+            root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+            base = os.path.join(root, "BirthdayPlayer", "Cache")
+        elif system == "Darwin":
+            base = os.path.expanduser("~/Library/Caches/BirthdayPlayer")
+        else:
+            root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+            base = os.path.join(root, "birthday_player")
+    
+    path = os.path.join(base, name) if name else base
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def prune_cache_dir(cache_dir: str, suffix, max_bytes: int, max_age: float = None):
+    """按最近使用时间（mtime）淘汰缓存文件：先删过期的，再删最旧的直到总大小不超过上限
+    
+    suffix 可以是单个后缀或后缀元组；同时清理写入中途崩溃留下、超过一小时的 .tmp 临时文件。
+    """
+    now = time.time()
+    entries = []
+    
+    for filename in os.listdir(cache_dir):
+        file_path = os.path.join(cache_dir, filename)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        if filename.endswith(".tmp"):
+            expired = st.st_mtime < now - 3600
+        elif filename.endswith(suffix):
+            expired = max_age is not None and st.st_mtime < now - max_age
+            if not expired:
+                entries.append((st.st_mtime, st.st_size, file_path))
+        else:
+            continue
+        if expired:
+            try:
+                os.remove(file_path)
+            except OSError:
                 pass
-        
-        # 如果都失败，使用默认配置
-        return {"bpm": 90, "message": "🎉 生日快乐歌播放完成！Happy Birthday! 🎂"}
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, file_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+常驻守护进程
+启动时导入音频和壁纸依赖、协商设备格式并打开一个常驻的输出流，预先渲染配置中的歌曲和壁纸并留在内存里；
+客户端通过本地套接字（Windows 上是命名管道）发送触发请求，守护进程把内存中的采样直接送进输出流的队列，
+不再付出解释器启动、导入、加载字体、合成和打开设备的开销
+
+播放期间到达的请求排队依次处理；与队列中（或刚开始播放的）请求相同的触发合并为一次
+"""
+
+import argparse
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import NamedTuple
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+import tracing
+from config import ConfigError, get_cache_dir, get_config, watch_config
+
+PIPE_NAME = r"\\.\pipe\BirthdayPlayer"
+# 客户端等待回复、服务端等待请求内容的最长时间（秒）
+REPLY_TIMEOUT = 2.0
+# 与正在播放、且开始不到这么多秒的请求相同的触发直接合并
+COALESCE_WINDOW = 2.0
+# 内存中常驻的歌曲数（按 bpm 和采样率），超出时淘汰最久未用的
+MAX_SONGS = 8
+
+class DaemonError(RuntimeError):
+    """守护进程没有运行、无法连接，或者已经有一个在运行"""
+
+class Output(NamedTuple):
+    """设备格式、块大小和常驻输出；重新加载配置时整体替换，播放中途不会看到一半新一半旧的值"""
+    fmt: object
+    block_size: int
+    stream: object
+
+def get_address() -> str:
+    if sys.platform == "win32":
+        return PIPE_NAME
+    return os.path.join(get_cache_dir(), "daemon.sock")
+
+def _authkey_path() -> str:
+    return os.path.join(get_cache_dir(), "daemon.key")
+
+def _read_authkey() -> bytes:
+    with open(_authkey_path(), "rb") as f:
+        return f.read()
+
+def _create_authkey() -> bytes:
+    """每次启动生成新的密钥，只有同一用户能读取；客户端用它完成连接时的握手"""
+    key = secrets.token_bytes(32)
+    path = _authkey_path()
+    fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(path + ".tmp", path)
+    return key
+
+def send(request: dict, address: str = None, timeout: float = REPLY_TIMEOUT) -> dict:
+    """发送一个请求并返回回复；守护进程不可用时抛出 DaemonError"""
+    address = get_address() if address is None else address
+    try:
+        authkey = _read_authkey()
+        conn = Client(address, authkey=authkey)
+    except (OSError, EOFError, AuthenticationError) as e:
+        raise DaemonError(f"无法连接守护进程 {address}: {e}") from e
+    
+    with conn:
+        try:
+            conn.send(request)
+            if not conn.poll(timeout):
+                raise DaemonError("守护进程没有响应")
+            return conn.recv()
+        except (OSError, EOFError) as e:
+            raise DaemonError(f"与守护进程的连接中断: {e}") from e
+
+def trigger(message: str = None, bpm: int = None, address: str = None) -> dict:
+    """请求守护进程播放并设置壁纸；message / bpm 为空时使用守护进程当前的配置"""
+    return send({"cmd": "trigger", "message": message, "bpm": bpm}, address)
+
+class Daemon:
+    def __init__(self, config: dict, address: str = None):
+        self.config = config
+        self.address = get_address() if address is None else address
+        self.output = None
+        self._songs = OrderedDict()
+        self._songs_lock = threading.Lock()
+        # 播放期间一直持有；替换输出前先拿到它，不会关掉正在播放的流
+        self._play_lock = threading.Lock()
+        # 待处理的 (message, bpm, 收到的时间)，以及正在处理的那一个
+        self._pending = deque()
+        self._current = None
+        self._current_start = 0.0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self.stats = {"triggers": 0, "played": 0, "coalesced": 0, "errors": 0, "last_latency_ms": None}
+    
+    def prepare(self, config: dict = None):
+        """导入依赖、协商设备格式、打开常驻输出，并预先渲染 config 中的歌曲和壁纸"""
+        config = self.config if config is None else config
+        from playback import AudioBackendError, negotiate_format, open_output, playback_block_size
+        
+        with tracing.span("daemon.prepare", bpm=config["bpm"]):
+            output = self.output
+            try:
+                fmt = negotiate_format()
+                if config.get("sample_rate") is not None:
+                    fmt = fmt._replace(sample_rate=config["sample_rate"])
+                block_size = config.get("block_size") or playback_block_size(fmt.sample_rate)
+                if output is None or (output.fmt, output.block_size) != (fmt, block_size):
+                    output = Output(fmt, block_size, open_output(fmt.sample_rate, block_size, fmt.dtype))
+            except AudioBackendError as e:
+                # 没有音频设备时仍然可以只设置壁纸
+                tracing.error("daemon.prepare", e)
+                print(f"音频不可用，只设置壁纸: {e}", file=sys.stderr)
+            # 先渲染好新格式的歌曲再替换，播放线程只会拿到完整的 Output
+            if output is not None:
+                self.song(config["bpm"], output.fmt.sample_rate)
+            if output is not self.output:
+                self._replace_output(output)
+            try:
+                self._render_wallpaper(config["message"], config.get("encoder_profile"))
+            except Exception as e:
+                tracing.error("daemon.prepare", e)
+        self.config = config
+    
+    def _replace_output(self, output: Output = None):
+        with self._play_lock:
+            old, self.output = self.output, output
+        if old is not None:
+            old.stream.close()
+    
+    def song(self, bpm: int, sample_rate: int):
+        """返回内存中的整首歌（float32），首次请求时读取磁盘缓存或渲染"""
+        import numpy as np
+        from render_cache import get_song
+        
+        key = (bpm, sample_rate)
+        with self._songs_lock:
+            if key in self._songs:
+                self._songs.move_to_end(key)
+                return self._songs[key]
+        # 磁盘缓存是内存映射，拷贝一份进内存，播放时不会因缺页而卡顿；之后只读
+        song = np.array(get_song(bpm, sample_rate))
+        song.flags.writeable = False
+        with self._songs_lock:
+            self._songs[key] = song
+            while len(self._songs) > MAX_SONGS:
+                self._songs.popitem(last=False)
+        return song
+    
+    def _render_wallpaper(self, message: str, profile: str = None) -> str:
+        from screen import get_screen_size
+        from wallpaper_cache import get_wallpaper
+        return get_wallpaper(message, profile, size=get_screen_size())
+    
+    def _play(self, message: str, bpm: int, received: float):
+        from wallpaper import create_and_set_wallpaper
+        
+        # 壁纸在后台的壁纸线程里渲染和设置，与播放同时进行
+        wallpaper = create_and_set_wallpaper(message, self.config.get("encoder_profile"), wait=False)
+        with self._play_lock:
+            output = self.output
+            if output is not None:
+                song = self.song(bpm, output.fmt.sample_rate)
+                block_size = output.block_size
+                
+                def started():
+                    self.stats["last_latency_ms"] = round((time.perf_counter() - received) * 1000, 3)
+                
+                blocks = (song[offset:offset + block_size] for offset in range(0, song.size, block_size))
+                with tracing.span("daemon.playback", bpm=bpm):
+                    output.stream.play(blocks, on_start=started)
+        try:
+            wallpaper.result()
+        except Exception as e:
+            tracing.error("daemon.wallpaper", e)
+    
+    def submit(self, message: str = None, bpm: int = None) -> dict:
+        """加入队列；与排队中或刚开始播放的请求相同时合并，返回是否合并和队列长度"""
+        message = self.config["message"] if message is None else message
+        bpm = self.config["bpm"] if bpm is None else bpm
+        received = time.perf_counter()
+        with self._cond:
+            self.stats["triggers"] += 1
+            recent = self._current is not None and received - self._current_start < COALESCE_WINDOW
+            if (recent and self._current == (message, bpm)) or \
+                    any((m, b) == (message, bpm) for m, b, _ in self._pending):
+                self.stats["coalesced"] += 1
+                return {"ok": True, "coalesced": True, "queued": len(self._pending)}
+            self._pending.append((message, bpm, received))
+            self._cond.notify()
+            return {"ok": True, "coalesced": False, "queued": len(self._pending)}
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop.is_set():
+                    self._cond.wait()
+                if self._stop.is_set():
+                    return
+                message, bpm, received = self._pending.popleft()
+                self._current = (message, bpm)
+                self._current_start = time.perf_counter()
+            try:
+                self._play(message, bpm, received)
+                self.stats["played"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                tracing.error("daemon.trigger", e, bpm=bpm)
+            finally:
+                with self._cond:
+                    self._current = None
+    
+    def _reload(self, config: dict):
+        print("配置已修改，重新预渲染", file=sys.stderr)
+        self.prepare(config)
+    
+    def handle(self, request) -> dict:
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "请求应为字典"}
+        cmd = request.get("cmd")
+        if cmd == "trigger":
+            message, bpm = request.get("message"), request.get("bpm")
+            if message is not None and not isinstance(message, str):
+                return {"ok": False, "error": "message 应为字符串"}
+            if bpm is not None and (isinstance(bpm, bool) or not isinstance(bpm, int) or not 20 <= bpm <= 400):
+                return {"ok": False, "error": "bpm 应为 20 到 400 之间的整数"}
+            return self.submit(message, bpm)
+        if cmd == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if cmd == "status":
+            with self._cond:
+                return {"ok": True, "pid": os.getpid(), "queued": len(self._pending),
+                        "playing": self._current is not None, **self.stats}
+        if cmd == "stop":
+            self.stop()
+            return {"ok": True}
+        return {"ok": False, "error": f"未知的命令: {cmd}"}
+    
+    def stop(self):
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+    
+    def _check_address(self):
+        """套接字文件还在但连不上时是上次崩溃留下的，删除后重新监听"""
+        if sys.platform == "win32" or not os.path.exists(self.address):
+            return
+        try:
+            send({"cmd": "ping"}, self.address)
+        except DaemonError:
+            os.remove(self.address)
+            return
+        raise DaemonError(f"守护进程已经在运行: {self.address}")
+    
+    def serve(self, ready: threading.Event = None):
+        """监听请求直到收到 stop；ready 在开始监听后设置"""
+        self._check_address()
+        listener = Listener(self.address, authkey=_create_authkey())
+        worker = threading.Thread(target=self._worker, name="daemon-worker", daemon=True)
+        worker.start()
+        watcher_stop = threading.Event()
+        watch_config(self._reload, stop=watcher_stop)
+        if ready is not None:
+            ready.set()
+        
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    tracing.error("daemon.accept", e)
+                    continue
+                with conn:
+                    try:
+                        # 请求很小，直接在监听线程里处理；连上却不发送的客户端超时后断开
+                        if conn.poll(REPLY_TIMEOUT):
+                            conn.send(self.handle(conn.recv()))
+                    except (OSError, EOFError) as e:
+                        tracing.error("daemon.request", e)
+        finally:
+            watcher_stop.set()
+            self.stop()
+            listener.close()
+            worker.join(timeout=REPLY_TIMEOUT)
+            if not worker.is_alive():
+                self._replace_output(None)
+
+def run_daemon(address: str = None) -> bool:
+    try:
+        config = get_config()
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        return False
+    tracing.configure(config.get("trace"))
+    
+    daemon = Daemon(config, address)
+    start = time.perf_counter()
+    daemon.prepare()
+    print(f"守护进程已就绪（{(time.perf_counter() - start) * 1000:.0f}ms），监听 {daemon.address}", file=sys.stderr)
+    try:
+        daemon.serve()
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return False
+    except KeyboardInterrupt:
+        pass
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生日歌常驻守护进程及其客户端")
+    parser.add_argument("command", nargs="?", default="serve", choices=["serve", "trigger", "status", "stop"])
+    parser.add_argument("--message", default=None, help="触发时显示的文字，默认取守护进程的配置")
+    parser.add_argument("--bpm", type=int, default=None, help="触发时的速度，默认取守护进程的配置")
+    parser.add_argument("--address", default=None, help="套接字路径或命名管道名")
+    args = parser.parse_args(argv)
+    
+    if args.command == "serve":
+        return run_daemon(args.address)
+    try:
+        if args.command == "trigger":
+            reply = trigger(args.message, args.bpm, args.address)
+        else:
+            reply = send({"cmd": args.command}, args.address)
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return False
+    print(json.dumps(reply, ensure_ascii=False))
+    return reply.get("ok", False)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
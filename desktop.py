@@ -0,0 +1,124 @@
+"""
+Linux 桌面壁纸后端注册表
+根据 shutil.which 和桌面会话环境变量检测一次可用的后端，并把结果持久化，
+之后的启动直接使用，不再逐个 fork/exec 未安装的工具
+"""
+
+import json
+import os
+import shutil
+import subprocess
+
+from config import get_cache_dir
+
+# 设置壁纸的外部命令最长等待时间（秒），wallpaper 中的 macOS 后端也使用它
+COMMAND_TIMEOUT = 5
+
+# 名称 -> (可执行文件, 匹配的桌面会话关键字, 生成命令列表的函数)
+BACKENDS = {}
+
+def register_backend(name: str, executable: str, sessions, build_commands):
+    BACKENDS[name] = (executable, tuple(s.lower() for s in sessions), build_commands)
+
+register_backend(
+    "gnome", "gsettings", ("gnome", "unity", "ubuntu", "budgie", "pantheon"),
+    lambda path: [
+        ["gsettings", "set", "org.gnome.desktop.background", "picture-uri", f"file://{path}"],
+        # GNOME 42 之后深色模式使用单独的键，不存在时忽略失败
+        ["gsettings", "set", "org.gnome.desktop.background", "picture-uri-dark", f"file://{path}"],
+    ],
+)
+register_backend(
+    "cinnamon", "gsettings", ("cinnamon", "x-cinnamon"),
+    lambda path: [["gsettings", "set", "org.cinnamon.desktop.background", "picture-uri", f"file://{path}"]],
+)
+register_backend(
+    "mate", "gsettings", ("mate",),
+    lambda path: [["gsettings", "set", "org.mate.background", "picture-filename", path]],
+)
+register_backend(
+    "kde", "plasma-apply-wallpaperimage", ("kde", "plasma"),
+    lambda path: [["plasma-apply-wallpaperimage", path]],
+)
+register_backend("feh", "feh", (), lambda path: [["feh", "--bg-scale", path]])
+register_backend("nitrogen", "nitrogen", (), lambda path: [["nitrogen", "--set-scaled", path]])
+
+_backend = None
+
+def _session() -> str:
+    parts = [os.environ.get(name, "") for name in ("XDG_CURRENT_DESKTOP", "DESKTOP_SESSION", "GDMSESSION")]
+    return ":".join(parts).lower()
+
+def _state_path() -> str:
+    return os.path.join(get_cache_dir(), "desktop_backend.json")
+
+def _load_choice():
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("session") != _session():
+        return None
+    return state.get("backend")
+
+def _save_choice(name):
+    try:
+        with open(_state_path(), "w", encoding="utf-8") as f:
+            json.dump({"session": _session(), "backend": name}, f)
+    except OSError:
+        pass
+
+def candidates():
+    """已安装的后端，当前桌面会话对应的排在前面"""
+    session = _session()
+    available = [name for name, (exe, _, _) in BACKENDS.items() if shutil.which(exe)]
+    matching = [name for name in available
+                if any(keyword in session for keyword in BACKENDS[name][1])]
+    others = [name for name in available if name not in matching]
+    # 会话不匹配的 gsettings 类后端可能“成功”却不起作用，排在 feh 等通用工具之后
+    others.sort(key=lambda name: bool(BACKENDS[name][1]))
+    return matching + others
+
+def detect_backend(refresh: bool = False):
+    """返回当前使用的后端名称，没有可用后端时返回 None"""
+    global _backend
+    if _backend is not None and not refresh:
+        return _backend
+    
+    choice = None if refresh else _load_choice()
+    if choice in BACKENDS and shutil.which(BACKENDS[choice][0]):
+        _backend = choice
+        return _backend
+    
+    found = candidates()
+    _backend = found[0] if found else None
+    _save_choice(_backend)
+    return _backend
+
+def run_backend(name: str, image_path: str, timeout: float = COMMAND_TIMEOUT) -> bool:
+    """执行后端的命令：第一条命令决定成败，后续命令只是补充设置，失败可以忽略"""
+    _, _, build_commands = BACKENDS[name]
+    for i, cmd in enumerate(build_commands(os.path.abspath(image_path))):
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+            ok = result.returncode == 0
+        except (OSError, subprocess.SubprocessError):
+            ok = False
+        if i == 0 and not ok:
+            return False
+    return True
+
+def set_wallpaper(image_path: str, timeout: float = COMMAND_TIMEOUT) -> bool:
+    """使用检测到的后端设置壁纸；失败时依次尝试其他已安装的后端，并记住成功的那个"""
+    global _backend
+    backend = detect_backend()
+    if backend is not None and run_backend(backend, image_path, timeout):
+        return True
+    
+    for name in candidates():
+        if name != backend and run_backend(name, image_path, timeout):
+            _backend = name
+            _save_choice(name)
+            return True
+    return False
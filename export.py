@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+离线导出生日歌
+逐块渲染并写入 WAV（安装了 soundfile 时也可以写 FLAC），不需要音频设备，整首歌不驻留内存；
+可以在多个进程中并行渲染 bpm × 移调 × 采样率 的全部组合
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from audio import BLOCK_SIZE, SAMPLE_RATE, iter_song_blocks
+from config import default_workers
+from wavetable import TIMBRES
+
+# 可选依赖：写 FLAC 需要 soundfile
+try:
+    import soundfile as sf
+except (ImportError, OSError):
+    sf = None
+
+# 导出时块可以比播放时大得多，减少 Python 层循环次数
+EXPORT_BLOCK_SIZE = 64 * BLOCK_SIZE
+
+def _to_pcm16(block: np.ndarray) -> bytes:
+    pcm = np.clip(block, -1.0, 1.0)
+    pcm *= 32767
+    return pcm.astype("<i2").tobytes()
+
+def export_song(path: str, bpm: int, sample_rate: int = None, transpose: float = 0,
+                block_size: int = None, timbre: str = None) -> dict:
+    """把歌曲写入 path，格式由扩展名决定（.wav 或 .flac），返回导出信息"""
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    block_size = EXPORT_BLOCK_SIZE if block_size is None else block_size
+    fmt = os.path.splitext(path)[1].lower().lstrip(".")
+    blocks = iter_song_blocks(bpm, block_size, sample_rate, transpose, timbre)
+    frames = 0
+    
+    if fmt == "wav":
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            for block in blocks:
+                f.writeframesraw(_to_pcm16(block))
+                frames += block.size
+    elif fmt == "flac":
+        if sf is None:
+            raise RuntimeError("导出 FLAC 需要安装 soundfile")
+        with sf.SoundFile(path, "w", samplerate=sample_rate, channels=1,
+                          format="FLAC", subtype="PCM_16") as f:
+            for block in blocks:
+                f.write(block)
+                frames += block.size
+    else:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    
+    return {
+        "path": path,
+        "bpm": bpm,
+        "transpose": transpose,
+        "sample_rate": sample_rate,
+        "timbre": timbre,
+        "frames": frames,
+        "duration": frames / sample_rate,
+    }
+
+def variant_filename(bpm: int, transpose: float, sample_rate: int, fmt: str) -> str:
+    return f"birthday_{bpm}bpm_{transpose:+g}st_{sample_rate}hz.{fmt}"
+
+def export_matrix(output_dir: str, bpms, transposes=(0,), sample_rates=(SAMPLE_RATE,),
+                  fmt: str = "wav", workers: int = None, timbre: str = None):
+    """并行导出全部组合，返回每个组合的结果（失败的带 error 字段）"""
+    os.makedirs(output_dir, exist_ok=True)
+    variants = list(itertools.product(bpms, transposes, sample_rates))
+    results = []
+    
+    with ProcessPoolExecutor(max_workers=workers or default_workers()) as pool:
+        futures = {}
+        for bpm, transpose, sample_rate in variants:
+            path = os.path.join(output_dir, variant_filename(bpm, transpose, sample_rate, fmt))
+            futures[pool.submit(export_song, path, bpm, sample_rate, transpose, None, timbre)] = (bpm, transpose, sample_rate, path)
+        
+        for future in as_completed(futures):
+            bpm, transpose, sample_rate, path = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"path": path, "bpm": bpm, "transpose": transpose,
+                                "sample_rate": sample_rate, "error": f"{type(e).__name__}: {e}"})
+    
+    results.sort(key=lambda r: (r["bpm"], r["transpose"], r["sample_rate"]))
+    return results
+
+def _parse_list(value: str, convert):
+    return [convert(v) for v in value.split(",") if v.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线导出生日歌（无需音频设备）")
+    parser.add_argument("-o", "--output", default="export", help="输出目录")
+    parser.add_argument("--bpm", default="90", help="逗号分隔的 bpm 列表，如 80,90,120")
+    parser.add_argument("--transpose", default="0", help="逗号分隔的移调半音数，如 -2,0,3")
+    parser.add_argument("--sample-rate", default=str(SAMPLE_RATE), help="逗号分隔的采样率，如 44100,48000")
+    parser.add_argument("--format", default="wav", choices=["wav", "flac"], help="输出格式")
+    parser.add_argument("--timbre", default=None, choices=sorted(TIMBRES),
+                        help="用波表振荡器渲染的音色，默认使用正弦合成")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作进程数，默认取配置项 workers，未设置时为 CPU 核数")
+    args = parser.parse_args(argv)
+    
+    start = time.perf_counter()
+    results = export_matrix(
+        args.output,
+        _parse_list(args.bpm, int),
+        _parse_list(args.transpose, float),
+        _parse_list(args.sample_rate, int),
+        args.format,
+        args.workers,
+        args.timbre,
+    )
+    print(json.dumps({"seconds": time.perf_counter() - start, "results": results},
+                     ensure_ascii=False, indent=2))
+    return all("error" not in r for r in results)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
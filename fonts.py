@@ -0,0 +1,310 @@
+"""
+字体索引
+扫描一次系统字体目录，记录每个字体的家族名和覆盖的 Unicode 范围，持久化到缓存目录；
+任一字体目录的 mtime 变化时重建。挑选能显示某段文字的字体时不再逐个打开字体文件。
+"""
+
+import bisect
+import json
+import os
+import platform
+import struct
+import tempfile
+
+from config import get_cache_dir
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc")
+# 索引格式变化时递增
+INDEX_VERSION = 1
+
+_index = None
+# 字体路径 -> (范围起点列表, 范围终点列表)，用于二分查找
+_coverage = {}
+# 规范化路径 -> 索引中的路径，Windows 下路径大小写和分隔符不敏感
+_normalized = {}
+
+def get_font_dirs():
+    """各平台的标准字体目录"""
+    system = platform.system()
+    home = os.path.expanduser("~")
+    
+    if system == "Darwin":  # macOS
+        return [
+            "/System/Library/Fonts",
+            "/Library/Fonts",
+            os.path.join(home, "Library/Fonts"),
+        ]
+    elif system == "Windows":
+        windir = os.environ.get("WINDIR", "C:/Windows")
+        dirs = [os.path.join(windir, "Fonts")]
+        local = os.environ.get("LOCALAPPDATA")
+        if local:
+            dirs.append(os.path.join(local, "Microsoft", "Windows", "Fonts"))
+        return dirs
+    else:  # Linux等其他系统
+        data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local/share")
+        return [
+            "/usr/share/fonts",
+            "/usr/local/share/fonts",
+            os.path.join(home, ".fonts"),
+            os.path.join(data_home, "fonts"),
+        ]
+
+def _table_directory(f, offset: int) -> dict:
+    f.seek(offset + 4)
+    num_tables = struct.unpack(">H", f.read(2))[0]
+    f.seek(offset + 12)
+    tables = {}
+    for _ in range(num_tables):
+        tag, _checksum, table_offset, length = struct.unpack(">4sIII", f.read(16))
+        tables[tag] = (table_offset, length)
+    return tables
+
+def _read_family(f, tables: dict):
+    """从 name 表读取家族名（nameID 1），优先 Windows Unicode 记录"""
+    if b"name" not in tables:
+        return None
+    offset, _ = tables[b"name"]
+    f.seek(offset)
+    _format, count, string_offset = struct.unpack(">HHH", f.read(6))
+    records = [struct.unpack(">HHHHHH", f.read(12)) for _ in range(count)]
+    
+    best = None
+    for platform_id, _encoding, language, name_id, length, str_offset in records:
+        if name_id != 1:
+            continue
+        rank = 0 if (platform_id == 3 and language == 0x409) else 1 if platform_id in (0, 3) else 2
+        if best is None or rank < best[0]:
+            best = (rank, platform_id, length, str_offset)
+    if best is None:
+        return None
+    
+    _, platform_id, length, str_offset = best
+    f.seek(offset + string_offset + str_offset)
+    raw = f.read(length)
+    return raw.decode("utf-16-be" if platform_id in (0, 3) else "mac_roman", errors="replace")
+
+def _cmap_format4(f, offset: int):
+    f.seek(offset + 6)
+    seg_count = struct.unpack(">H", f.read(2))[0] // 2
+    f.seek(offset + 14)
+    ends = struct.unpack(f">{seg_count}H", f.read(2 * seg_count))
+    f.read(2)  # reservedPad
+    starts = struct.unpack(f">{seg_count}H", f.read(2 * seg_count))
+    deltas = struct.unpack(f">{seg_count}h", f.read(2 * seg_count))
+    range_offsets_pos = f.tell()
+    range_offsets = struct.unpack(f">{seg_count}H", f.read(2 * seg_count))
+    
+    ranges = []
+    for i in range(seg_count):
+        start, end = starts[i], ends[i]
+        if start == 0xFFFF:
+            continue
+        if range_offsets[i] == 0:
+            # 字形号为 (c + delta) & 0xFFFF，只有结果为 0 的码位缺字
+            missing = (-deltas[i]) & 0xFFFF
+            if start <= missing <= end:
+                if start < missing:
+                    ranges.append((start, missing - 1))
+                if missing < end:
+                    ranges.append((missing + 1, end))
+            else:
+                ranges.append((start, end))
+            continue
+        # 通过 glyphIdArray 间接映射，逐个码位检查
+        glyph_pos = range_offsets_pos + 2 * i + range_offsets[i]
+        f.seek(glyph_pos)
+        glyphs = struct.unpack(f">{end - start + 1}H", f.read(2 * (end - start + 1)))
+        run_start = None
+        for code, glyph in zip(range(start, end + 1), glyphs):
+            if glyph:
+                if run_start is None:
+                    run_start = code
+            elif run_start is not None:
+                ranges.append((run_start, code - 1))
+                run_start = None
+        if run_start is not None:
+            ranges.append((run_start, end))
+    return ranges
+
+def _cmap_format12(f, offset: int):
+    f.seek(offset + 12)
+    num_groups = struct.unpack(">I", f.read(4))[0]
+    data = f.read(12 * num_groups)
+    return [(start, end) for start, end, _ in struct.iter_unpack(">III", data)]
+
+def _read_cmap_ranges(f, tables: dict):
+    """读取 cmap 表中的 Unicode 子表，返回合并后的 [(起始码位, 结束码位), ...]"""
+    if b"cmap" not in tables:
+        return []
+    offset, _ = tables[b"cmap"]
+    f.seek(offset + 2)
+    num_subtables = struct.unpack(">H", f.read(2))[0]
+    subtables = {}
+    for _ in range(num_subtables):
+        platform_id, encoding_id, sub_offset = struct.unpack(">HHI", f.read(8))
+        f_pos = f.tell()
+        f.seek(offset + sub_offset)
+        fmt = struct.unpack(">H", f.read(2))[0]
+        f.seek(f_pos)
+        subtables.setdefault((platform_id, encoding_id, fmt), offset + sub_offset)
+    
+    # 优先完整 Unicode（format 12），其次 BMP（format 4）
+    for key in ((3, 10, 12), (0, 4, 12), (0, 6, 12), (0, 3, 12)):
+        if key in subtables:
+            ranges = _cmap_format12(f, subtables[key])
+            break
+    else:
+        for key in ((3, 1, 4), (0, 3, 4), (0, 4, 4), (0, 1, 4), (0, 0, 4)):
+            if key in subtables:
+                ranges = _cmap_format4(f, subtables[key])
+                break
+        else:
+            return []
+    
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def read_font_info(path: str) -> dict:
+    """读取字体（集合文件取第一个）的家族名和 Unicode 覆盖范围"""
+    with open(path, "rb") as f:
+        tag = f.read(4)
+        offset = 0
+        if tag == b"ttcf":
+            f.seek(12)
+            offset = struct.unpack(">I", f.read(4))[0]
+        tables = _table_directory(f, offset)
+        return {
+            "family": _read_family(f, tables),
+            "ranges": _read_cmap_ranges(f, tables),
+        }
+
+def _dir_stamps(dirs):
+    """所有字体目录（含子目录）的 mtime，任一变化即需要重建索引"""
+    stamps = {}
+    for root_dir in dirs:
+        if not os.path.isdir(root_dir):
+            stamps[root_dir] = None
+            continue
+        for dirpath, _dirnames, _filenames in os.walk(root_dir):
+            try:
+                stamps[dirpath] = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                stamps[dirpath] = None
+    return stamps
+
+def build_index(dirs=None) -> dict:
+    dirs = get_font_dirs() if dirs is None else dirs
+    fonts = {}
+    for root_dir in dirs:
+        for dirpath, _dirnames, filenames in os.walk(root_dir):
+            for filename in filenames:
+                if not filename.lower().endswith(FONT_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    fonts[path] = read_font_info(path)
+                except (OSError, struct.error, UnicodeDecodeError):
+                    continue
+    return {
+        "version": INDEX_VERSION,
+        "dirs": _dir_stamps(dirs),
+        "fonts": fonts,
+        "lookups": {},
+    }
+
+def _index_path() -> str:
+    return os.path.join(get_cache_dir("fonts"), "font_index.json")
+
+def _save_index(index: dict):
+    path = _index_path()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def get_index() -> dict:
+    """读取持久化的索引；目录有变化或文件损坏时重新扫描"""
+    global _index
+    if _index is not None:
+        return _index
+    
+    dirs = get_font_dirs()
+    index = None
+    try:
+        with open(_index_path(), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION or index.get("dirs") != _dir_stamps(dirs):
+            index = None
+    except (OSError, ValueError):
+        index = None
+    
+    if index is None:
+        index = build_index(dirs)
+        _save_index(index)
+    
+    _index = index
+    _coverage.clear()
+    _normalized.clear()
+    for path, info in index["fonts"].items():
+        _coverage[path] = ([start for start, _ in info["ranges"]],
+                           [end for _, end in info["ranges"]])
+        _normalized[_normalize(path)] = path
+    return _index
+
+def _normalize(path: str) -> str:
+    return os.path.normcase(os.path.normpath(path))
+
+def _style_rank(path: str) -> int:
+    """常规字重排在粗体、斜体等变体之前"""
+    name = os.path.basename(path).lower()
+    return sum(word in name for word in ("bold", "italic", "oblique", "light", "thin", "black", "mono"))
+
+def covers(path: str, char: str) -> bool:
+    starts, ends = _coverage[path]
+    code = ord(char)
+    i = bisect.bisect_right(starts, code) - 1
+    return i >= 0 and code <= ends[i]
+
+def find_font_for_text(text: str, preferred=()):
+    """返回能显示 text 全部字符的字体路径
+    
+    preferred 中的字体优先，其余按常规字重优先；没有字体能完整覆盖时返回覆盖字符最多的字体，
+    一个字符都显示不了时返回 None。
+    结果按字符集合记录在索引里，下次启动直接查表。
+    """
+    index = get_index()
+    chars = "".join(sorted({c for c in text if not c.isspace()}))
+    if not chars:
+        return None
+    if chars in index["lookups"]:
+        path = index["lookups"][chars]
+        if path is None or path in index["fonts"]:
+            return path
+    
+    fonts = index["fonts"]
+    candidates = [_normalized[_normalize(p)] for p in preferred if _normalize(p) in _normalized]
+    candidates += sorted((p for p in fonts if p not in candidates), key=lambda p: (_style_rank(p), p))
+    
+    best_path, best_count = None, 0
+    for path in candidates:
+        count = sum(covers(path, c) for c in chars)
+        if count > best_count:
+            best_path, best_count = path, count
+        if count == len(chars):
+            break
+    
+    index["lookups"][chars] = best_path
+    _save_index(index)
+    return best_path
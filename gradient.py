@@ -0,0 +1,157 @@
+"""
+渐变背景生成
+整幅像素数组由 NumPy 一次向量化计算，再交给 Pillow
+像素按 RGBX 打包成 uint32，查表和广播都按整像素进行；水平、竖直方向的线性渐变只算一列（一行），
+由 Pillow 铺满整幅
+"""
+
+import numpy as np
+from PIL import Image, ImageColor
+
+# 颜色查找表的精度，远高于 8 位颜色通道能区分的级数
+LUT_SIZE = 1024
+
+def _parse_stops(stops):
+    """stops: [(位置 0~1, 颜色), ...]，颜色可以是 "#rrggbb"、颜色名或 RGB 元组"""
+    if len(stops) < 1:
+        raise ValueError("至少需要一个色标")
+    
+    parsed = []
+    for position, color in stops:
+        if isinstance(color, str):
+            color = ImageColor.getrgb(color)[:3]
+        parsed.append((min(max(float(position), 0.0), 1.0), tuple(color[:3])))
+    parsed.sort(key=lambda stop: stop[0])
+    
+    positions = np.array([p for p, _ in parsed])
+    colors = np.array([c for _, c in parsed], dtype=np.float64)
+    return positions, colors
+
+def _color_lut(stops) -> np.ndarray:
+    """返回 LUT_SIZE 个打包为 uint32 的 RGBX 颜色"""
+    positions, colors = _parse_stops(stops)
+    x = np.linspace(0.0, 1.0, LUT_SIZE)
+    lut = np.full((LUT_SIZE, 4), 255, dtype=np.uint8)
+    for channel in range(3):
+        lut[:, channel] = np.round(np.interp(x, positions, colors[:, channel]))
+    return lut.view(np.uint32)[:, 0]
+
+def _apply_lut(t: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """把 0~1 的位置数组原地量化为查找表下标，再一次性取色"""
+    np.clip(t, 0.0, 1.0, out=t)
+    t *= LUT_SIZE - 1
+    t += 0.5
+    return lut[t.astype(np.uint16)]
+
+def _unpack(pixels: np.ndarray) -> np.ndarray:
+    return pixels.view(np.uint8).reshape(pixels.shape + (4,))
+
+def _axis_line(size, stops, angle: float):
+    """水平或竖直的线性渐变只需一列（一行）颜色
+    
+    返回形状为 (height, 1) 或 (1, width) 的打包颜色；其他方向返回 None
+    """
+    width, height = size
+    theta = np.deg2rad(angle)
+    dx, dy = np.cos(theta), np.sin(theta)
+    if abs(dx) >= 1e-9 and abs(dy) >= 1e-9:
+        return None
+    vertical = abs(dx) < 1e-9
+    n = height if vertical else width
+    t = (np.arange(n, dtype=np.float32) + 0.5) / n
+    if (dy if vertical else dx) < 0:
+        t = t[::-1].copy()
+    line = _apply_lut(t, _color_lut(stops))
+    return line[:, None] if vertical else line[None, :]
+
+def gradient_array(size, stops, kind: str = "linear", angle: float = 90.0,
+                   center=(0.5, 0.5), radius: float = None) -> np.ndarray:
+    """生成形状为 (height, width, 4) 的 uint8 渐变数组，通道顺序为 RGBX
+    
+    linear: angle 为渐变方向，0 度从左到右，90 度从上到下
+    radial: center 为相对坐标的圆心，radius 默认为圆心到最远角的距离（像素）
+    """
+    width, height = size
+    
+    if kind == "linear":
+        line = _axis_line(size, stops, angle)
+        if line is not None:
+            return _unpack(np.ascontiguousarray(np.broadcast_to(line, (height, width))))
+        
+        lut = _color_lut(stops)
+        theta = np.deg2rad(angle)
+        dx, dy = np.cos(theta), np.sin(theta)
+        x = (np.arange(width, dtype=np.float32) + 0.5) * np.float32(dx)
+        y = (np.arange(height, dtype=np.float32) + 0.5) * np.float32(dy)
+        t = x[None, :] + y[:, None]
+        lo = min(0.0, width * dx) + min(0.0, height * dy)
+        hi = max(0.0, width * dx) + max(0.0, height * dy)
+        t -= np.float32(lo)
+        t *= np.float32(1.0 / (hi - lo))
+        return _unpack(_apply_lut(t, lut))
+    
+    if kind == "radial":
+        lut = _color_lut(stops)
+        cx, cy = center[0] * width, center[1] * height
+        if radius is None:
+            radius = max(np.hypot(corner_x - cx, corner_y - cy)
+                         for corner_x in (0, width) for corner_y in (0, height))
+        x = np.arange(width, dtype=np.float32) + np.float32(0.5 - cx)
+        y = np.arange(height, dtype=np.float32) + np.float32(0.5 - cy)
+        t = np.square(x)[None, :] + np.square(y)[:, None]
+        np.sqrt(t, out=t)
+        t *= np.float32(1.0 / max(radius, 1e-6))
+        return _unpack(_apply_lut(t, lut))
+    
+    raise ValueError(f"不支持的渐变类型: {kind}")
+
+def create_gradient(size, stops, kind: str = "linear", **kwargs) -> Image.Image:
+    if kind == "linear":
+        line = _axis_line(size, stops, kwargs.get("angle", 90.0))
+        if line is not None:
+            # 只把一列（一行）交给 Pillow，由最近邻缩放在 C 里铺满整幅，不在 NumPy 里生成整幅数组
+            return Image.fromarray(_unpack(line)[..., :3]).resize(size, Image.NEAREST)
+    pixels = gradient_array(size, stops, kind, **kwargs)
+    # RGB 图像在 Pillow 内部也是每像素 4 字节，RGBX 解码只是逐行拷贝
+    return Image.frombytes("RGB", size, pixels, "raw", "RGBX")
+
+def _draw_rows(size):
+    """旧实现：逐行 draw.line，仅用于对比测试"""
+    from PIL import ImageDraw
+    width, height = size
+    image = Image.new("RGB", (width, height), color="#1a1a2e")
+    draw = ImageDraw.Draw(image)
+    for y in range(height):
+        color_value = int(26 + (y / height) * 20)
+        color = (color_value, color_value, min(46 + int(y / height * 20), 80))
+        draw.line([(0, y), (width, y)], fill=color)
+    return image
+
+def benchmark(repeat: int = 3):
+    import time
+    
+    stops = [(0.0, (26, 26, 46)), (1.0, (46, 46, 66))]
+    sizes = {"1080p": (1920, 1080), "4K": (3840, 2160), "8K": (7680, 4320)}
+    results = {}
+    
+    for name, size in sizes.items():
+        row = {}
+        for label, func in (
+            ("draw_line", lambda: _draw_rows(size)),
+            ("linear", lambda: create_gradient(size, stops)),
+            ("linear_diagonal", lambda: create_gradient(size, stops, angle=30)),
+            ("radial", lambda: create_gradient(size, stops, "radial")),
+        ):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - start)
+            row[label] = best
+        results[name] = row
+        print(name, "  ".join(f"{k}={v * 1000:.1f}ms" for k, v in row.items()))
+    
+    return results
+
+if __name__ == "__main__":
+    benchmark()
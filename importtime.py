@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+冷启动导入耗时
+在新的解释器进程里用 python -X importtime 导入模块，解析 stderr 得到导入总耗时和最慢的依赖，
+用来跟踪 main.py 的冷启动开销；可以设置预算，超出时以非零状态退出
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# "import time:   self [us] | cumulative | 缩进的模块名"，缩进表示嵌套层级
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+def parse_importtime(output: str):
+    """返回 [(模块名, 自身微秒, 累计微秒, 层级), ...]，顺序与输出相同（子模块在父模块之前）"""
+    entries = []
+    for line in output.splitlines():
+        match = _LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            entries.append((name, int(own), int(cumulative), len(indent) // 2))
+    return entries
+
+def measure(module: str = "main", repeat: int = 5, top: int = 10) -> dict:
+    """导入 module repeat 次（每次都是新进程、冷导入），返回累计耗时的中位数和最慢的依赖"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    totals = []
+    entries = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=root, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+        entries = parse_importtime(result.stderr)
+        # 只看 module 自己这棵子树：它的条目之前、直到上一个顶层条目为止的部分
+        end = next(i for i, (name, _, _, level) in enumerate(entries) if name == module and level == 0)
+        begin = end
+        while begin > 0 and entries[begin - 1][3] > 0:
+            begin -= 1
+        entries = entries[begin:end + 1]
+        totals.append(entries[-1][2])
+    
+    # 最后一次运行里累计耗时最多的直接依赖，以及自身耗时最多的模块
+    direct = sorted(((name, c) for name, _, c, level in entries if level == 1), key=lambda e: -e[1])
+    own = sorted(((name, o) for name, o, _, _ in entries), key=lambda e: -e[1])
+    return {
+        "module": module,
+        "median_ms": statistics.median(totals) / 1000,
+        "runs_ms": [t / 1000 for t in totals],
+        "direct_ms": {name: c / 1000 for name, c in direct[:top]},
+        "self_ms": {name: o / 1000 for name, o in own[:top]},
+        "imported": sorted({name for name, _, _, _ in entries}),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量模块的冷启动导入耗时（python -X importtime）")
+    parser.add_argument("modules", nargs="*", default=["main"], help="要测量的模块，默认 main")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="每个模块冷导入的次数")
+    parser.add_argument("--budget", type=float, default=None, help="中位数超过这个毫秒数时返回失败")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出全部结果")
+    args = parser.parse_args(argv)
+    
+    results = [measure(module, args.repeat) for module in args.modules]
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for r in results:
+            heavy = [name for name in ("numpy", "PIL", "sounddevice", "simpleaudio") if name in r["imported"]]
+            print(f"{r['module']}: {r['median_ms']:.1f}ms（{len(r['imported'])} 个模块"
+                  f"{'，含 ' + '、'.join(heavy) if heavy else ''}）")
+            for name, ms in r["direct_ms"].items():
+                print(f"    {name:<28} {ms:8.1f}ms")
+    
+    if args.budget is not None:
+        return all(r["median_ms"] <= args.budget for r in results)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
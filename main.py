@@ -4,20 +4,156 @@
 功能：播放生日歌并生成临时壁纸
 """
 
-from config import get_config
-from audio import generate_song, play_audio
-from wallpaper import create_and_set_wallpaper
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def main():
-    config = get_config()
+# 各阶段的依赖（numpy、PIL、音频库）在阶段真正运行时才导入，import main 只加载标准库和 config
+import tracing
+from config import ConfigError, get_config
+
+def _timed_blocks(blocks, timings: dict, t0: float):
+    """记录第一块就绪的时间和渲染总耗时（不含播放等待）"""
+    synthesis = 0.0
+    count = 0
+    begin = time.perf_counter()
+    blocks = iter(blocks)
+    while True:
+        start = time.perf_counter()
+        block = next(blocks, None)
+        end = time.perf_counter()
+        synthesis += end - start
+        if block is None:
+            break
+        count += 1
+        if "first_block" not in timings:
+            timings["first_block"] = end - t0
+            tracing.complete("audio.first_block", begin, end, samples=int(block.size))
+        yield block
+    timings["synthesis"] = synthesis
+    # 合成与播放交替进行，这一段从开始取块到最后一块，实际渲染耗时见 busy_ms
+    tracing.complete("audio.synthesis", begin, time.perf_counter(), blocks=count,
+                     busy_ms=round(synthesis * 1000, 3))
+
+def _play_song(bpm: int, timings: dict, t0: float, score_path: str = None,
+               sample_rate: int = None, block_size: int = None):
+    from playback import negotiate_format, play_stream, playback_block_size
+    from render_cache import iter_cached_song_blocks
+    
+    # 没有可用的音频后端时抛出 AudioBackendError，只跳过这一路
+    # 按设备的原生采样率渲染，省去系统重采样
+    # 配置了 sample_rate / block_size 时以配置为准，设备再做重采样
+    with tracing.span("audio.negotiate") as span:
+        fmt = negotiate_format()
+        if sample_rate is not None:
+            fmt = fmt._replace(sample_rate=sample_rate)
+        if block_size is None:
+            block_size = playback_block_size(fmt.sample_rate)
+        span.set(sample_rate=fmt.sample_rate, dtype=fmt.dtype, block_size=block_size)
+    if score_path:
+        # 配置了乐谱文件时播放该乐谱（编译结果有缓存），否则播放内置的生日歌；
+        # 乐谱自带的速度优先，配置的 bpm 只用于没有写速度的乐谱
+        from score import iter_file_blocks
+        blocks = iter_file_blocks(os.path.expanduser(score_path), None, block_size, fmt.sample_rate,
+                                  default_bpm=bpm)
+    else:
+        blocks = iter_cached_song_blocks(bpm, block_size, fmt.sample_rate)
+    blocks = _timed_blocks(blocks, timings, t0)
+    with tracing.span("audio.playback") as span:
+        played = play_stream(blocks, fmt.sample_rate, block_size, fmt.dtype)
+        span.set(ok=played)
+    return played
+
+def _set_wallpaper(message: str, profile: str = None):
+    from wallpaper import create_and_set_wallpaper
+    return create_and_set_wallpaper(message, profile)
+
+def run_pipeline(config: dict) -> dict:
+    """壁纸和音频在线程池中并行执行，任何一路失败都不影响另一路"""
+    timings = {}
+    t0 = time.perf_counter()
+    
+    def stage(name, func, *args):
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"stage.{name}"):
+                return func(*args)
+        finally:
+            timings[name] = {"start": start - t0, "end": time.perf_counter() - t0}
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [
+            pool.submit(stage, "audio", _play_song, config["bpm"], timings, t0, config.get("score"),
+                        config.get("sample_rate"), config.get("block_size")),
+            pool.submit(stage, "wallpaper", _set_wallpaper, config["message"], config.get("encoder_profile")),
+        ]
+        for name, future in zip(("audio", "wallpaper"), futures):
+            try:
+                future.result()
+            except Exception as e:
+                tracing.error(f"stage.{name}", e)
+    
+    timings["total"] = time.perf_counter() - t0
+    return timings
+
+def main(report_timings: bool = False, strict_config: bool = False):
+    start = time.perf_counter()
+    try:
+        # 配置不合法时默认记录错误并退回默认配置；strict_config 时直接报告，不带着错误的取值运行
+        config = get_config(strict=strict_config)
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        return False
+    # 追踪由环境变量 BIRTHDAY_TRACE 或配置项 "trace" 开启，读取配置本身也记录在内
+    tracing.configure(config.get("trace"))
+    tracing.complete("config.load", start, time.perf_counter())
     
     try:
-        create_and_set_wallpaper(config["message"])
-        song = generate_song(config["bpm"])
-        play_audio(song)
-        
+        timings = run_pipeline(config)
+        if report_timings:
+            print(json.dumps(timings, indent=2), file=sys.stderr)
+    
     except Exception as e:
+        tracing.error("main", e)
+    
+    tracing.finish()
+    return True
+
+def startup_check() -> bool:
+    """导入各阶段的全部依赖后立即返回，不播放也不设置壁纸；打包后用来测量启动耗时"""
+    import numpy
+    from PIL import Image, ImageDraw, ImageFont
+    
+    import playback
+    import render_cache
+    import wallpaper
+    import wallpaper_cache
+    
+    get_config()
+    try:
+        playback.get_backend()
+    except playback.AudioBackendError as e:
         pass
+    return True
+
+def trigger_daemon() -> bool:
+    """交给常驻守护进程（daemon.py）播放，守护进程没有运行时返回 False"""
+    from daemon import DaemonError, trigger
+    try:
+        return trigger().get("ok", False)
+    except DaemonError as e:
+        return False
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    args = sys.argv[1:]
+    if "--startup-check" in args:
+        sys.exit(0 if startup_check() else 1)
+    if "--daemon" in args:
+        from daemon import run_daemon
+        sys.exit(0 if run_daemon() else 1)
+    # --trigger: 守护进程在运行时只发送请求，否则照常在本进程中运行
+    if "--trigger" in args and trigger_daemon():
+        sys.exit(0)
+    sys.exit(0 if main(report_timings="--timings" in args, strict_config="--strict-config" in args) else 1)
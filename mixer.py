@@ -0,0 +1,323 @@
+"""
+多声部混音
+乐谱由若干声部组成，每个声部是一条 (音名, 拍数) 旋律和一个音量；
+渲染时对每个块取出所有正在发声的音符，整块覆盖的音符按音高合并成一次矩阵乘法，
+在块内起止的音符用一次带掩码的 (音符 × 采样) 广播，求和后
+写入预分配的缓冲区，最后做余量和软限幅
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+import audio
+
+# 混音总线的余量（-3 dB）和限幅上限
+HEADROOM = 10 ** (-3 / 20)
+CEILING = 0.95
+# 软限幅从上限的这个比例开始压缩
+KNEE = 0.8
+# 离线渲染的块大小：块越大，每块固定的 Python 开销摊得越薄
+RENDER_BLOCK_SIZE = 16 * audio.BLOCK_SIZE
+
+class Voice(NamedTuple):
+    melody: list
+    gain: float = 1.0
+
+# 3/4 拍，C 大调：弱起 1 拍，之后每小节一个和弦
+# C | G | G | C | C | F | C G | C
+_CHORDS = [
+    ("REST", 1),
+    ("C", 3), ("G", 3), ("G", 3), ("C", 3),
+    ("C", 3), ("F", 3), ("C", 2), ("G", 1), ("C", 2),
+]
+_CHORD_TONES = {
+    "C": ("C3", "E3", "G3"),
+    "F": ("F3", "A3", "C4"),
+    "G": ("G2", "B2", "D3"),
+}
+
+def _chord_line(index: int):
+    return [(note if note == "REST" else _CHORD_TONES[note][index], beats) for note, beats in _CHORDS]
+
+ACCOMPANIMENT = [
+    Voice(_chord_line(0), 0.5),   # 根音（低音）
+    Voice(_chord_line(1), 0.25),  # 三音
+    Voice(_chord_line(2), 0.25),  # 五音
+]
+
+DEFAULT_SCORE = [Voice(audio.MELODY, 1.0)] + ACCOMPANIMENT
+
+class ScoreEvents(NamedTuple):
+    """所有声部的音符合并成一张表；pitch 是音符在 freqs（去重后的频率）中的下标"""
+    start: np.ndarray
+    end: np.ndarray
+    length: np.ndarray
+    pitch: np.ndarray
+    phase: np.ndarray
+    gain: np.ndarray
+    freqs: tuple
+    sample_rate: int
+    total: int
+
+def compile_score(score, bpm: int, sample_rate: int = None, transpose: float = 0) -> ScoreEvents:
+    """逐个声部编译（各声部内部相位连续），再把休止以外的音符拼成一张表"""
+    sample_rate = audio.SAMPLE_RATE if sample_rate is None else sample_rate
+    parts = []
+    total = 0
+    for voice in score:
+        events = audio.compile_melody(bpm, voice.melody, sample_rate, transpose)
+        keep = events.freq > 0
+        parts.append((events, keep, voice.gain))
+        total = max(total, events.total)
+    
+    def cat(field):
+        return np.concatenate([getattr(events, field)[keep] for events, keep, _ in parts])
+    
+    freqs, pitch = np.unique(cat("freq"), return_inverse=True)
+    return ScoreEvents(
+        start=cat("start"),
+        end=cat("end"),
+        length=cat("length"),
+        pitch=pitch.ravel(),
+        phase=cat("phase"),
+        gain=np.concatenate([np.full(int(keep.sum()), gain * audio.VOLUME) for _, keep, gain in parts]),
+        freqs=tuple(float(f) for f in freqs),
+        sample_rate=sample_rate,
+        total=total,
+    )
+
+def _basis(freqs: tuple, n: int, sample_rate: int) -> np.ndarray:
+    """形状为 (音高数, 6, size) 的只读 float32 表：sin(ωm)、cos(ωm) 以及它们乘以 m、m² 的四行，size ≥ n
+    
+    音符的包络在淡入、主体、淡出三段上各是音符内序号的二次多项式，所以一段在块内的波形是
+    (q0 + q1·m + q2·m²)·(a·sin(ωm) + b·cos(ωm))，也就是所在音高这六行的加权和，
+    所有段的系数拼在一起后整块只需一次矩阵乘法。表的前 m 列就是长度为 m 的块的表，
+    所以 size 取不小于 n 的 2 的幂，长度不同的块共用同一张表。
+    """
+    size = 1 << max(int(n) - 1, 0).bit_length()
+    
+    def build():
+        m = np.arange(size)
+        x = np.outer(2 * np.pi * np.asarray(freqs) / sample_rate, m)
+        table = np.empty((len(freqs), 6, size), dtype=np.float32)
+        table[:, 0] = np.sin(x)
+        table[:, 1] = np.cos(x)
+        for power in (1, 2):
+            weight = (m.astype(np.float64) ** power).astype(np.float32)
+            np.multiply(table[:, 0], weight, out=table[:, 2 * power])
+            np.multiply(table[:, 1], weight, out=table[:, 2 * power + 1])
+        return table
+    
+    return audio.waveform_cache.get(("basis", freqs, size, sample_rate), build)
+
+def soft_limit(block: np.ndarray, ceiling: float = CEILING, knee: float = KNEE) -> np.ndarray:
+    """超过 knee·ceiling 的部分用 tanh 平滑压缩，永不超过 ceiling（原地修改）"""
+    threshold = knee * ceiling
+    over = np.abs(block) > threshold
+    if over.any():
+        x = block[over]
+        room = ceiling - threshold
+        block[over] = np.sign(x) * (threshold + room * np.tanh((np.abs(x) - threshold) / room))
+    return block
+
+def _segments(events: ScoreEvents, index: np.ndarray):
+    """把音符 index 拆成淡入、主体、淡出三段（与 audio.envelope 相同的包络），去掉空段
+    
+    返回 (所属音符, 段起点, 段终点, 包络系数)：包络系数形状为 (段数, 3)，
+    是以音符内序号 j 为自变量的二次多项式 c0 + c1·j + c2·j² 的系数，不含音量。
+    """
+    length = events.length[index].astype(np.float64)
+    ramp = audio.ramp_samples(events.length[index], events.sample_rate)
+    release = np.maximum(events.length[index] - ramp, ramp)
+    e0 = audio.ENVELOPE_START
+    step = (audio.ENVELOPE_END - e0) / np.maximum(length - 1, 1)
+    zero = np.zeros_like(length)
+    
+    # 淡入 (e0 + s·j)·j/R，主体 e0 + s·j，淡出 (e0 + s·j)·(L - 1 - j)/R
+    lo = np.stack((np.zeros_like(ramp), ramp, release), axis=1)
+    hi = np.stack((ramp, release, events.length[index]), axis=1)
+    poly = np.stack((
+        np.stack((zero, e0 / ramp, step / ramp), axis=1),
+        np.stack((zero + e0, step, zero), axis=1),
+        np.stack((e0 * (length - 1) / ramp, (step * (length - 1) - e0) / ramp, -step / ramp), axis=1),
+    ), axis=1)
+    keep = hi > lo
+    note = np.broadcast_to(np.asarray(index)[:, None], keep.shape)[keep]
+    start = events.start[note]
+    return note, start + lo[keep], start + hi[keep], poly[keep]
+
+def _coefficients(events: ScoreEvents, note: np.ndarray, rel: np.ndarray, poly: np.ndarray,
+                  headroom: float) -> np.ndarray:
+    """音符 note 的一段从音符内序号 rel 处开始时对应六行基表的系数，形状 (段数, 6)；余量直接并入音量"""
+    gain = events.gain[note] * headroom
+    omega = 2 * np.pi * np.asarray(events.freqs)[events.pitch[note]] / events.sample_rate
+    theta = omega * rel + events.phase[note]
+    a, b = np.cos(theta), np.sin(theta)
+    # 把包络多项式平移到块首：j = rel + m
+    c0, c1, c2 = poly[:, 0], poly[:, 1], poly[:, 2]
+    q0 = (c0 + (c1 + c2 * rel) * rel) * gain
+    q1 = (c1 + 2 * c2 * rel) * gain
+    q2 = c2 * gain
+    return np.stack((a * q0, b * q0, a * q1, b * q1, a * q2, b * q2), axis=1)
+
+def _needs_limit(gain_sum) -> np.ndarray:
+    """所有音符同相叠加也到不了拐点时不必逐采样检查"""
+    peak = gain_sum * max(abs(audio.ENVELOPE_START), abs(audio.ENVELOPE_END))
+    return peak > KNEE * CEILING
+
+def mix_block(events: ScoreEvents, out: np.ndarray, offset: int = 0,
+              headroom: float = HEADROOM) -> np.ndarray:
+    """把 [offset, offset + out.size) 内所有发声的音符一次性混入 out"""
+    n = out.size
+    active = np.nonzero((events.start < offset + n) & (events.end > offset))[0]
+    if active.size == 0:
+        out[:] = 0
+        return out
+    basis = _basis(events.freqs, n, events.sample_rate)
+    
+    # 覆盖整块的段（一个音符至多一段）：按音高累加成 (音高 × 6) 的权重，
+    # 与发声音高范围内的表做一次矩阵乘法（不拷贝表）
+    note, start, end, poly = _segments(events, active)
+    full = (start <= offset) & (end >= offset + n)
+    if full.any():
+        pitch = events.pitch[note[full]]
+        coef = _coefficients(events, note[full], offset - events.start[note[full]], poly[full], headroom)
+        lo = int(pitch.min())
+        hi = int(pitch.max()) + 1
+        weights = np.zeros((hi - lo, 6))
+        np.add.at(weights, pitch - lo, coef)
+        np.matmul(weights.ravel().astype(np.float32), basis[lo:hi, :, :n].reshape(-1, n), out=out)
+    else:
+        out[:] = 0
+    
+    # 其余音符（在块内开始、结束或跨过淡入淡出的边界）：(音符 × 采样) 一次广播，
+    # 直接按音符内序号算包络，包络在音符以外为 0，同时起到掩码的作用
+    edge = np.setdiff1d(active, note[full], assume_unique=True)
+    if edge.size:
+        rel = offset - events.start[edge]
+        length = events.length[edge, None]
+        ramp = audio.ramp_samples(length, events.sample_rate)
+        omega = 2 * np.pi * np.asarray(events.freqs)[events.pitch[edge]] / events.sample_rate
+        theta = omega * rel + events.phase[edge]
+        j = rel[:, None] + np.arange(n, dtype=np.float64)
+        step = (audio.ENVELOPE_END - audio.ENVELOPE_START) / np.maximum(length - 1, 1)
+        envelope = (audio.ENVELOPE_START + step * j) * np.clip(np.minimum(j, length - 1 - j) / ramp, 0.0, 1.0)
+        envelope *= events.gain[edge, None] * headroom
+        ab = np.stack((np.cos(theta), np.sin(theta)), axis=1).astype(np.float32)
+        tone = np.einsum("kr,krn->kn", ab, basis[events.pitch[edge], :2, :n])
+        tone *= envelope
+        out += tone.sum(axis=0)
+    
+    if _needs_limit(events.gain[active].sum() * headroom):
+        soft_limit(out)
+    return out
+
+def block_bounds(events: ScoreEvents, block_size: int = None) -> np.ndarray:
+    """离线渲染的分块位置：每个音符的起止处和淡入淡出的边界处都切开，其余处每 block_size 切一次
+    
+    这样每一段包络都整块覆盖它所在的块，不需要逐采样屏蔽。
+    """
+    block_size = RENDER_BLOCK_SIZE if block_size is None else block_size
+    _, start, end, _ = _segments(events, np.arange(events.start.size))
+    marks = np.unique(np.concatenate(([0], start, end, [events.total])))
+    marks = marks[marks <= events.total]
+    # 相邻边界之间超过 block_size 的段再等分
+    pieces = -(-np.diff(marks) // block_size)
+    first = np.repeat(marks[:-1], pieces)
+    index = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    return np.append(first + index * block_size, events.total)
+
+def iter_blocks(events: ScoreEvents, block_size: int = None):
+    """逐块混音已编译的乐谱，内存占用只与块大小有关"""
+    block_size = audio.BLOCK_SIZE if block_size is None else block_size
+    for offset in range(0, events.total, block_size):
+        block = np.empty(min(block_size, events.total - offset), dtype=np.float32)
+        yield mix_block(events, block, offset)
+
+def render(events: ScoreEvents, block_size: int = None, headroom: float = HEADROOM) -> np.ndarray:
+    """把已编译的乐谱渲染到一个预分配的 float32 缓冲区；离线渲染不受回调延迟限制，默认用更大的块
+    
+    分块切在所有包络段的起止处，每个 (块, 段) 都是整块覆盖，于是所有块的系数可以一次算完、
+    按 (块, 音高) 累加成权重，逐块只剩一次矩阵乘法。
+    """
+    block_size = RENDER_BLOCK_SIZE if block_size is None else block_size
+    song = np.empty(events.total, dtype=np.float32)
+    bounds = block_bounds(events, block_size)
+    count = bounds.size - 1
+    pitches = len(events.freqs)
+    
+    # 展开成 (块, 段) 对：每段覆盖从其起点到终点之间的所有块
+    note, start, end, poly = _segments(events, np.arange(events.start.size))
+    first = np.searchsorted(bounds, start)
+    spans = np.searchsorted(bounds, np.minimum(end, events.total)) - first
+    segment = np.repeat(np.arange(start.size), spans)
+    note = note[segment]
+    block = np.repeat(first - np.cumsum(spans) + spans, spans) + np.arange(spans.sum())
+    coef = _coefficients(events, note, bounds[block] - events.start[note], poly[segment], headroom)
+    
+    pitch = events.pitch[note]
+    cell = block * pitches + pitch
+    weights = np.empty((count, pitches, 6), dtype=np.float32)
+    for r in range(6):
+        weights[:, :, r] = np.bincount(cell, coef[:, r], minlength=count * pitches).reshape(count, pitches)
+    lo = np.full(count, pitches)
+    hi = np.zeros(count, dtype=int)
+    np.minimum.at(lo, block, pitch)
+    np.maximum.at(hi, block, pitch + 1)
+    limit = _needs_limit(np.bincount(block, events.gain[note], minlength=count) * headroom)
+    basis = _basis(events.freqs, int(np.diff(bounds).max(initial=1)), events.sample_rate)
+    
+    for k in range(count):
+        out = song[bounds[k]:bounds[k + 1]]
+        if lo[k] >= hi[k]:
+            out[:] = 0
+            continue
+        n = out.size
+        np.matmul(weights[k, lo[k]:hi[k]].ravel(), basis[lo[k]:hi[k], :, :n].reshape(-1, n), out=out)
+        if limit[k]:
+            soft_limit(out)
+    return song
+
+def iter_score_blocks(score, bpm: int, block_size: int = None, sample_rate: int = None):
+    return iter_blocks(compile_score(score, bpm, sample_rate), block_size)
+
+def render_score(score=None, bpm: int = 90, sample_rate: int = None, block_size: int = None) -> np.ndarray:
+    """渲染整首多声部乐曲到一个预分配的 float32 缓冲区"""
+    score = DEFAULT_SCORE if score is None else score
+    return render(compile_score(score, bpm, sample_rate), block_size)
+
+def benchmark(voice_counts=(1, 2, 4, 8, 16, 32), bpm: int = 90, repeat: int = 3):
+    """渲染耗时随声部数的变化，并与逐声部调用 render_events 再相加的做法对比"""
+    import time
+    
+    results = {}
+    for count in voice_counts:
+        # 重复默认乐谱的旋律与伴奏凑出 count 个声部，音量按声部数均分
+        pool = DEFAULT_SCORE * (count // len(DEFAULT_SCORE) + 1)
+        score = [Voice(v.melody, v.gain / count) for v in pool[:count]]
+        
+        def naive():
+            song = None
+            for voice in score:
+                events = audio.compile_melody(bpm, voice.melody)
+                part = audio.render_events(events, np.empty(events.total, dtype=np.float32))
+                part *= voice.gain
+                song = part if song is None else song[:part.size] + part[:song.size]
+            return song
+        
+        row = {}
+        for label, func in (("mixer", lambda: render_score(score, bpm)), ("per_voice", naive)):
+            best = float("inf")
+            for _ in range(repeat):
+                audio.waveform_cache.clear()
+                start = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - start)
+            row[label] = best
+        results[count] = row
+        print(f"{count:3d} 声部: mixer={row['mixer'] * 1000:.1f}ms  per_voice={row['per_voice'] * 1000:.1f}ms")
+    return results
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,13 +1,45 @@
 #!/usr/bin/env python3
 """
 支持打包为 Windows (.exe) 和 macOS (.app) 版本
+两种构建档位：onefile 是单个可执行文件，每次启动都要先把整个包解压到临时目录；
+fast-start 是目录形式（onedir），按导入追踪排除用不到的模块，大的原生库不做 UPX 压缩，
+省去每次启动的解压，目的是缩短启动时间；实际差别要在目标平台上用 --compare 测量
 """
 
+import argparse
+import json
 import os
+import statistics
 import sys
 import platform
 import subprocess
 import shutil
+import tempfile
+import time
+
+# 档位名 -> 说明
+BUILD_PROFILES = {
+    "onefile": "单文件，每次启动解压到临时目录",
+    "fast-start": "目录形式，排除未用到的模块，大的原生库不做 UPX 压缩",
+}
+DEFAULT_BUILD_PROFILE = "onefile"
+
+# 程序运行时会导入的模块；各阶段的依赖是延迟导入的，必须显式列出才会出现在追踪结果里
+RUNTIME_MODULES = (
+    "main", "config", "tracing", "audio", "playback", "render_cache", "score", "mixer", "wavetable",
+    "wallpaper", "wallpaper_cache", "base_image", "gradient", "encoders", "fonts", "desktop", "screen",
+    "daemon", "scheduler", "numpy", "PIL.Image", "PIL.ImageDraw", "PIL.ImageFont",
+    "sounddevice", "simpleaudio", "soundfile",
+)
+# 可以排除的顶层模块；导入追踪中出现的会保留
+EXCLUDE_CANDIDATES = (
+    "tkinter", "_tkinter", "turtle", "turtledemo", "idlelib", "test", "unittest", "doctest",
+    "pydoc", "pydoc_data", "lib2to3", "distutils", "setuptools", "pkg_resources", "pip",
+    "xmlrpc", "sqlite3", "_sqlite3", "curses", "ensurepip", "venv",
+    "IPython", "matplotlib", "scipy", "pandas", "pytest", "PyInstaller",
+)
+# 超过这个大小的原生库不做 UPX 压缩：压缩后每次加载都要先解压，拖慢启动
+UPX_MAX_BYTES = 1024 * 1024
 
 def install_pyinstaller():
     """安装PyInstaller"""
@@ -21,6 +53,26 @@ def install_pyinstaller():
         except subprocess.CalledProcessError:
             return False
 
+def trace_imports(modules=RUNTIME_MODULES) -> set:
+    """在新的解释器里导入 modules（装不上的跳过），返回所有被加载的顶层模块名"""
+    code = (
+        "import importlib, json, sys\n"
+        f"for name in {list(modules)!r}:\n"
+        "    try:\n"
+        "        importlib.import_module(name)\n"
+        "    except Exception:\n"
+        "        pass\n"
+        "print(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))\n"
+    )
+    root = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    return set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+def get_excludes(traced: set = None):
+    """候选模块中没有出现在导入追踪里的部分，作为 PyInstaller 的 excludes"""
+    traced = trace_imports() if traced is None else traced
+    return [name for name in EXCLUDE_CANDIDATES if name not in traced]
+
 def get_pyinstaller_args():
     """获取PyInstaller打包参数"""
     system = platform.system()
@@ -70,8 +122,7 @@ def get_pyinstaller_args():
     
     return args
 
-def create_spec_file():
-    """创建自定义的spec文件"""
+def _spec_datas() -> str:
     # 动态构建数据文件列表
     datas = []
     if os.path.exists("config.json"):
@@ -79,7 +130,14 @@ def create_spec_file():
     if os.path.exists("wallpaper_basic.png"):
         datas.append("('wallpaper_basic.png', '.')")
     
-    datas_str = ",\n        ".join(datas) if datas else ""
+    return ",\n        ".join(datas) if datas else ""
+
+def create_spec_file(profile: str = DEFAULT_BUILD_PROFILE):
+    """创建自定义的spec文件"""
+    if profile == "fast-start":
+        return create_fast_start_spec_file()
+    
+    datas_str = _spec_datas()
     
     spec_content = f'''# -*- mode: python ; coding: utf-8 -*-
 import os
@@ -136,11 +194,105 @@ app = BUNDLE(
     bundle_identifier='com.birthday.player',
 )
 '''
+
+    with open("BirthdayPlayer.spec", "w", encoding="utf-8") as f:
+        f.write(spec_content)
+
+def create_fast_start_spec_file(excludes=None):
+    """创建 fast-start 档位的 spec 文件：onedir 布局，排除未用到的模块，大的原生库不做 UPX 压缩"""
+    datas_str = _spec_datas()
+    excludes = get_excludes() if excludes is None else excludes
     
+    spec_content = f'''# -*- mode: python ; coding: utf-8 -*-
+import os
+import sys
+
+block_cipher = None
+
+a = Analysis(
+    ['main.py'],
+    pathex=[],
+    binaries=[],
+    datas=[
+        {datas_str}
+    ],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={{}},
+    runtime_hooks=[],
+    # 由 pack.get_excludes() 按导入追踪生成
+    excludes={excludes!r},
+    win_no_prefer_redirects=False,
+    win_private_assemblies=False,
+    cipher=block_cipher,
+    noarchive=False,
+)
+
+pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# numpy、PIL、PortAudio 等大的原生库不做 UPX 压缩，省去每次启动时的解压
+upx_exclude = sorted({{os.path.basename(dest) for dest, src, kind in a.binaries
+                      if _size(src) > {UPX_MAX_BYTES}}})
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='BirthdayPlayer',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    upx_exclude=upx_exclude,
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=upx_exclude,
+    name='BirthdayPlayer',
+)
+
+if sys.platform == 'darwin':
+    app = BUNDLE(
+        coll,
+        name='BirthdayPlayer.app',
+        icon='icon.icns' if os.path.exists('icon.icns') else None,
+        bundle_identifier='com.birthday.player',
+    )
+'''
+
     with open("BirthdayPlayer.spec", "w", encoding="utf-8") as f:
         f.write(spec_content)
 
-def pack_application():
+def get_executable(profile: str = DEFAULT_BUILD_PROFILE, distpath: str = "dist") -> str:
+    """构建产物中可执行文件的路径"""
+    system = platform.system()
+    if system == "Darwin":
+        return os.path.join(distpath, "BirthdayPlayer.app", "Contents", "MacOS", "BirthdayPlayer")
+    name = "BirthdayPlayer.exe" if system == "Windows" else "BirthdayPlayer"
+    if profile == "fast-start":
+        return os.path.join(distpath, "BirthdayPlayer", name)
+    return os.path.join(distpath, name)
+
+def pack_application(profile: str = DEFAULT_BUILD_PROFILE, distpath: str = "dist"):
     """打包应用程序"""
     system = platform.system()
     
@@ -153,40 +305,31 @@ def pack_application():
         return False
     
     # 清理之前的构建
-    if os.path.exists("dist"):
-        shutil.rmtree("dist")
+    if os.path.exists(distpath):
+        shutil.rmtree(distpath)
     if os.path.exists("build"):
         shutil.rmtree("build")
     
     try:
-        if system == "Darwin":  # macOS
-            # 创建spec文件用于macOS app bundle
-            create_spec_file()
-            cmd = [sys.executable, "-m", "PyInstaller", "BirthdayPlayer.spec"]
+        if system == "Darwin" or profile == "fast-start":
+            # 创建spec文件用于macOS app bundle；fast-start 档位在所有平台都用 spec 文件
+            create_spec_file(profile)
+            cmd = [sys.executable, "-m", "PyInstaller", "BirthdayPlayer.spec", "--noconfirm", "--clean"]
         else:
             # 直接使用命令行参数
             cmd = get_pyinstaller_args()
+        cmd.extend(["--distpath", distpath])
         
         # 执行打包
         result = subprocess.run(cmd, check=True, capture_output=True, text=True)
         
         # 检查输出文件
-        if system == "Darwin":
-            if os.path.exists("dist/BirthdayPlayer.app"):
-                return True
-        elif system == "Windows":
-            if os.path.exists("dist/BirthdayPlayer.exe"):
-                return True
-        else:  # Linux
-            if os.path.exists("dist/BirthdayPlayer"):
-                return True
-        
-        return False
-        
+        return os.path.exists(get_executable(profile, distpath))
+    
     except subprocess.CalledProcessError as e:
         return False
 
-def create_basic_info():
+def create_basic_info(distpath: str = "dist"):
     """创建基础信息文件"""
     system = platform.system()
     
@@ -197,24 +340,103 @@ def create_basic_info():
     else:
         info = "🎂 Birthday Player - Linux版本"
     
-    with open("dist/README.txt", "w", encoding="utf-8") as f:
+    with open(os.path.join(distpath, "README.txt"), "w", encoding="utf-8") as f:
         f.write(info)
 
-def main():
+def _bundle_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def measure_startup(executable: str, runs: int = 5, timeout: float = 120) -> dict:
+    """无界面地启动构建好的程序（main.py --startup-check：导入全部依赖后立即退出）并计时
+    
+    第一次运行使用空的程序缓存目录（first_run_empty_app_cache），但不清空系统的文件页缓存，
+    构建刚写出的文件通常还在内存里，所以它不是真正的冷启动；之后 runs 次算作热启动。
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, BIRTHDAY_CACHE_DIR=cache_dir)
+        times = []
+        for _ in range(runs + 1):
+            start = time.perf_counter()
+            subprocess.run([executable, "--startup-check"], env=env, timeout=timeout, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+    return {
+        "first_run_empty_app_cache": times[0],
+        "warm_median": statistics.median(times[1:]),
+        "warm_best": min(times[1:]),
+        "runs": times,
+    }
+
+def compare_profiles(runs: int = 5, root: str = "build_compare") -> dict:
+    """分别构建每个档位并测量启动耗时，返回 {档位: 结果}"""
+    results = {}
+    for profile in BUILD_PROFILES:
+        distpath = os.path.join(root, profile)
+        if not pack_application(profile, distpath):
+            results[profile] = {"error": "构建失败"}
+            continue
+        bundle = os.path.dirname(get_executable(profile, distpath)) if profile == "fast-start" else \
+            get_executable(profile, distpath)
+        results[profile] = dict(measure_startup(get_executable(profile, distpath), runs),
+                                size_bytes=_bundle_size(bundle))
+    return results
+
+def _cleanup():
+    # 清理临时文件
+    if os.path.exists("BirthdayPlayer.spec"):
+        os.remove("BirthdayPlayer.spec")
+    if os.path.exists("build"):
+        shutil.rmtree("build")
+
+def main(argv=None):
     """主函数"""
-    if pack_application():
+    parser = argparse.ArgumentParser(description="用 PyInstaller 打包 BirthdayPlayer")
+    parser.add_argument("--profile", default=DEFAULT_BUILD_PROFILE, choices=list(BUILD_PROFILES),
+                        help="; ".join(f"{name}: {desc}" for name, desc in BUILD_PROFILES.items()))
+    parser.add_argument("--measure", action="store_true", help="构建后无界面启动，记录首次（空缓存目录）和热启动耗时")
+    parser.add_argument("--compare", action="store_true", help="依次构建所有档位并对比启动耗时")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="热启动的测量次数")
+    parser.add_argument("--report", default="startup_report.json", help="启动耗时的输出文件")
+    parser.add_argument("--print-excludes", action="store_true", help="只打印由导入追踪得到的排除列表")
+    args = parser.parse_args(argv)
+    
+    if args.print_excludes:
+        print("\n".join(get_excludes()))
+        return True
+    
+    if args.compare:
+        results = compare_profiles(args.runs)
+        _cleanup()
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return all("error" not in r for r in results.values())
+    
+    if pack_application(args.profile):
         # 创建基础信息
         create_basic_info()
         
-        # 复制配置文件到输出目录
+        # 复制配置文件到输出目录；onedir 布局中放在可执行文件旁边，程序从那里读取
         if os.path.exists("config.json"):
-            shutil.copy2("config.json", "dist/")
+            target = os.path.dirname(get_executable(args.profile)) if args.profile == "fast-start" else "dist/"
+            shutil.copy2("config.json", target)
+        
+        _cleanup()
         
-        # 清理临时文件
-        if os.path.exists("BirthdayPlayer.spec"):
-            os.remove("BirthdayPlayer.spec")
-        if os.path.exists("build"):
-            shutil.rmtree("build")
+        if args.measure:
+            results = {args.profile: measure_startup(get_executable(args.profile), args.runs)}
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(json.dumps(results, ensure_ascii=False, indent=2))
         
         return True
     else:
@@ -0,0 +1,374 @@
+"""
+音频播放后端
+后端按注册顺序尝试，第一次真正播放时才导入对应的库；没有可用后端时抛出 AudioBackendError，
+调用方捕获后可以只跳过播放，离线渲染和导出完全不依赖本模块
+"""
+
+import json
+import os
+import queue
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from audio import BLOCK_SIZE, SAMPLE_RATE, iter_song_blocks
+import tracing
+from config import get_cache_dir
+
+# float32 样本转 16 位 PCM 的比例；渲染结果都在 [-1, 1] 以内
+PCM_SCALE = 32767
+# 常驻输出流的队列最多积压的块数，以及等待设备取走数据时检查流是否还在运行的间隔（秒）
+OUTPUT_QUEUE_BLOCKS = 16
+OUTPUT_POLL_INTERVAL = 0.5
+
+class AudioBackendError(RuntimeError):
+    """没有可用的音频后端，或指定的后端无法加载"""
+
+class AudioFormat(NamedTuple):
+    """输出设备的原生采样率和样本格式（"float32" 或 "int16"）"""
+    sample_rate: int
+    dtype: str
+    device: str = None
+
+def write_samples(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """把 float32 样本写入设备格式的 dst（float32 或 int16），转换时不产生中间数组"""
+    if dst.dtype == np.int16:
+        np.multiply(src, PCM_SCALE, out=dst, casting="unsafe")
+    else:
+        dst[:] = src
+    return dst
+
+# 设备 -> AudioFormat 的进程内缓存；支持的样本格式还会持久化，下次启动不必再检查
+_formats = {}
+
+def _format_state_path() -> str:
+    return os.path.join(get_cache_dir(), "audio_formats.json")
+
+def _load_formats() -> dict:
+    try:
+        with open(_format_state_path(), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+def _save_format(key: str, dtype: str):
+    state = _load_formats()
+    state[key] = dtype
+    try:
+        with open(_format_state_path(), "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+    except OSError:
+        pass
+
+class SoundDeviceBackend:
+    name = "sounddevice"
+    
+    def __init__(self, sd):
+        self.sd = sd
+    
+    def negotiate_format(self, refresh: bool = False) -> AudioFormat:
+        """查询默认输出设备的原生采样率和样本格式，按设备缓存
+        
+        直接按设备采样率渲染，系统就不必再重采样；float32 优先（渲染结果本身就是 float32），
+        不支持时用 int16。
+        """
+        sd = self.sd
+        try:
+            info = sd.query_devices(kind="output")
+            hostapi = sd.query_hostapis(info["hostapi"])["name"]
+            sample_rate = int(info["default_samplerate"]) or SAMPLE_RATE
+        except Exception as e:
+            return AudioFormat(SAMPLE_RATE, "float32")
+        # 采样率也放进键里：用户在系统设置里改了设备采样率时重新检查
+        key = f"{hostapi}:{info['name']}@{sample_rate}"
+        
+        if not refresh:
+            if key in _formats:
+                return _formats[key]
+            dtype = _load_formats().get(key)
+            if dtype in ("float32", "int16"):
+                _formats[key] = AudioFormat(sample_rate, dtype, key)
+                return _formats[key]
+        
+        dtype = "int16"
+        for candidate in ("float32", "int16"):
+            try:
+                sd.check_output_settings(channels=1, dtype=candidate, samplerate=sample_rate)
+            except Exception as e:
+                continue
+            dtype = candidate
+            break
+        _formats[key] = AudioFormat(sample_rate, dtype, key)
+        _save_format(key, dtype)
+        return _formats[key]
+    
+    def block_size(self, sample_rate: int) -> int:
+        return BLOCK_SIZE
+    
+    def play_stream(self, blocks, sample_rate: int, block_size: int, dtype: str):
+        sd = self.sd
+        # 当前块和块内读取位置
+        state = [next(blocks, None), 0]
+        finished = threading.Event()
+        
+        def callback(outdata, frames, time_info, status):
+            out = outdata[:, 0]
+            filled = 0
+            while filled < frames:
+                block, pos = state
+                if block is None:
+                    out[filled:] = 0
+                    raise sd.CallbackStop
+                n = min(frames - filled, block.size - pos)
+                write_samples(block[pos:pos + n], out[filled:filled + n])
+                filled += n
+                state[1] = pos + n
+                if state[1] == block.size:
+                    state[0], state[1] = next(blocks, None), 0
+        
+        stream = sd.OutputStream(
+            samplerate=sample_rate,
+            blocksize=block_size,
+            channels=1,
+            dtype=dtype,
+            callback=callback,
+            finished_callback=finished.set,
+        )
+        with stream:
+            finished.wait()
+    
+    def play(self, song: np.ndarray, sample_rate: int):
+        self.sd.play(song, sample_rate)
+        self.sd.wait()
+    
+    def open_output(self, sample_rate: int, block_size: int, dtype: str):
+        return PersistentOutput(self.sd, sample_rate, block_size, dtype)
+
+class PersistentOutput:
+    """一直打开的输出流：回调从队列里取块，队列为空时输出静音
+    
+    每次播放只是把块放进队列，不再打开设备、协商缓冲区，第一块在下一次回调时就能出声。
+    队列里除了块还可以放无参函数，回调取到时直接调用，用来标记一段播放的开始和结束。
+    """
+    
+    def __init__(self, sd, sample_rate: int, block_size: int, dtype: str):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.dtype = dtype
+        self.queue = queue.Queue(maxsize=OUTPUT_QUEUE_BLOCKS)
+        # 当前块和块内读取位置，只在回调线程里读写
+        self._state = [None, 0]
+        self.stream = sd.OutputStream(
+            samplerate=sample_rate,
+            blocksize=block_size,
+            channels=1,
+            dtype=dtype,
+            callback=self._callback,
+        )
+        self.stream.start()
+    
+    def _callback(self, outdata, frames, time_info, status):
+        out = outdata[:, 0]
+        filled = 0
+        while filled < frames:
+            block, pos = self._state
+            if block is None:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    out[filled:] = 0
+                    return
+                if callable(item):
+                    item()
+                else:
+                    self._state[0], self._state[1] = item, 0
+                continue
+            n = min(frames - filled, block.size - pos)
+            write_samples(block[pos:pos + n], out[filled:filled + n])
+            filled += n
+            self._state[1] = pos + n
+            if self._state[1] == block.size:
+                self._state[0], self._state[1] = None, 0
+    
+    def _put(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=OUTPUT_POLL_INTERVAL)
+                return
+            except queue.Full:
+                if not self.stream.active:
+                    raise AudioBackendError("输出流已停止")
+    
+    def play(self, blocks, on_start=None):
+        """把 blocks 依次放进队列，等设备播放完最后一块才返回；on_start 在第一块开始输出时调用"""
+        done = threading.Event()
+        if on_start is not None:
+            self._put(on_start)
+        for block in blocks:
+            self._put(block)
+        self._put(done.set)
+        while not done.wait(OUTPUT_POLL_INTERVAL):
+            if not self.stream.active:
+                raise AudioBackendError("输出流已停止")
+    
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+class StreamingOutput:
+    """不支持常驻输出流的后端：每次播放都重新打开，接口与 PersistentOutput 相同"""
+    
+    def __init__(self, backend, sample_rate: int, block_size: int, dtype: str):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.dtype = dtype
+    
+    def play(self, blocks, on_start=None):
+        def started():
+            for i, block in enumerate(blocks):
+                if i == 0 and on_start is not None:
+                    on_start()
+                yield block
+        
+        self.backend.play_stream(started(), self.sample_rate, self.block_size, self.dtype)
+    
+    def close(self):
+        pass
+
+class SimpleAudioBackend:
+    name = "simpleaudio"
+    
+    def __init__(self, sa):
+        self.sa = sa
+    
+    def negotiate_format(self, refresh: bool = False) -> AudioFormat:
+        # simpleaudio 无法查询设备，只能播放整数 PCM
+        return AudioFormat(SAMPLE_RATE, "int16")
+    
+    def block_size(self, sample_rate: int) -> int:
+        # 分块播放时块与块之间有间隙，块大一些听起来更连贯
+        return sample_rate
+    
+    def play_stream(self, blocks, sample_rate: int, block_size: int, dtype: str):
+        # simpleaudio 无法流式写入，退化为分块播放，并在播放当前块时渲染下一块；
+        # 两个 int16 缓冲区轮流使用，写入的那个一定已经播放完毕
+        play_obj = None
+        buffers = [np.empty(0, dtype=np.int16)] * 2
+        for i, block in enumerate(blocks):
+            if buffers[i % 2].size < block.size:
+                buffers[i % 2] = np.empty(block.size, dtype=np.int16)
+            pcm = write_samples(block, buffers[i % 2][:block.size])
+            if play_obj is not None:
+                play_obj.wait_done()
+            play_obj = self.sa.play_buffer(pcm, 1, 2, sample_rate)
+        if play_obj is not None:
+            play_obj.wait_done()
+    
+    def play(self, song: np.ndarray, sample_rate: int):
+        pcm = write_samples(song, np.empty(song.size, dtype=np.int16))
+        self.sa.play_buffer(pcm, 1, 2, sample_rate).wait_done()
+
+def _load_sounddevice():
+    import sounddevice
+    return SoundDeviceBackend(sounddevice)
+
+def _load_simpleaudio():
+    import simpleaudio
+    return SimpleAudioBackend(simpleaudio)
+
+# 名称 -> 导入库并返回后端对象的函数，按注册顺序优先
+BACKENDS = {}
+
+def register_backend(name: str, load):
+    BACKENDS[name] = load
+
+register_backend("sounddevice", _load_sounddevice)
+# 找不到 PortAudio 时 sounddevice 导入会抛出 OSError，退回 simpleaudio
+register_backend("simpleaudio", _load_simpleaudio)
+
+_backend = None
+_backend_error = None
+
+def get_backend(name: str = None):
+    """返回后端对象；name 为空时按注册顺序取第一个能加载的，结果在进程内缓存"""
+    global _backend, _backend_error
+    if name is None:
+        if _backend is not None:
+            return _backend
+        if _backend_error is not None:
+            raise _backend_error
+    
+    if name is not None and name not in BACKENDS:
+        raise AudioBackendError(f"未知的音频后端: {name}（可选: {', '.join(BACKENDS)}）")
+    
+    errors = []
+    for candidate in [name] if name is not None else list(BACKENDS):
+        try:
+            backend = BACKENDS[candidate]()
+        except (ImportError, OSError) as e:
+            errors.append(f"{candidate}: {e}")
+            continue
+        if name is None:
+            _backend = backend
+        return backend
+    
+    error = AudioBackendError("没有可用的音频后端（" + "；".join(errors) + "）")
+    if name is None:
+        _backend_error = error
+    raise error
+
+def negotiate_format(refresh: bool = False) -> AudioFormat:
+    return get_backend().negotiate_format(refresh)
+
+def playback_block_size(sample_rate: int = None) -> int:
+    return get_backend().block_size(SAMPLE_RATE if sample_rate is None else sample_rate)
+
+def play_stream(blocks, sample_rate: int = None, block_size: int = None, dtype: str = "float32"):
+    """边渲染边播放：拿到第一块就开始出声
+    
+    blocks 的采样率应与 sample_rate 一致；dtype 是设备的样本格式，转换在拷贝进设备缓冲区时完成。
+    没有可用后端时抛出 AudioBackendError，设备出错时返回 False。
+    """
+    backend = get_backend()
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    block_size = BLOCK_SIZE if block_size is None else block_size
+    try:
+        backend.play_stream(iter(blocks), sample_rate, block_size, dtype)
+        return True
+    except Exception as e:
+        tracing.error("audio.playback", e, backend=backend.name)
+        return False
+
+def open_output(sample_rate: int = None, block_size: int = None, dtype: str = "float32"):
+    """打开一个常驻的输出，反复调用其 play(blocks) 播放，不用时 close()
+    
+    后端不支持常驻输出流时退化为每次播放重新打开；没有可用后端时抛出 AudioBackendError。
+    """
+    backend = get_backend()
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    block_size = BLOCK_SIZE if block_size is None else block_size
+    if hasattr(backend, "open_output"):
+        try:
+            return backend.open_output(sample_rate, block_size, dtype)
+        except Exception as e:
+            raise AudioBackendError(f"无法打开输出流: {e}") from e
+    return StreamingOutput(backend, sample_rate, block_size, dtype)
+
+def play_song_streaming(bpm: int, block_size: int = None):
+    fmt = negotiate_format()
+    block_size = playback_block_size(fmt.sample_rate) if block_size is None else block_size
+    blocks = iter_song_blocks(bpm, block_size, fmt.sample_rate)
+    return play_stream(blocks, fmt.sample_rate, block_size, fmt.dtype)
+
+def play_audio(song: np.ndarray, sample_rate: int = None):
+    """播放整首歌；song 应按 sample_rate（默认 SAMPLE_RATE）渲染，最好就是 negotiate_format() 的采样率"""
+    backend = get_backend()
+    try:
+        backend.play(song, SAMPLE_RATE if sample_rate is None else sample_rate)
+        return True
+    except Exception as e:
+        tracing.error("audio.playback", e, backend=backend.name)
+        return False
@@ -0,0 +1,138 @@
+"""
+渲染结果磁盘缓存
+同样的旋律和参数总是得到同样的采样，缓存为 .npy 后下次启动直接内存映射读取
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import audio
+from config import get_cache_dir, prune_cache_dir
+
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# 渲染算法改变输出时递增，使旧缓存失效
+RENDER_VERSION = 2
+
+def song_key(bpm: int, sample_rate: int = None) -> str:
+    """由旋律、音高表、bpm、采样率和音量计算缓存键"""
+    sample_rate = audio.SAMPLE_RATE if sample_rate is None else sample_rate
+    payload = json.dumps({
+        "version": RENDER_VERSION,
+        "melody": audio.MELODY,
+        "note_freq": audio.NOTE_FREQ,
+        "bpm": bpm,
+        "sample_rate": sample_rate,
+        "volume": audio.VOLUME,
+        "envelope": [audio.ENVELOPE_START, audio.ENVELOPE_END, audio.RAMP_SECONDS],
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_path(key: str) -> str:
+    return os.path.join(get_cache_dir("songs"), f"{key}.npy")
+
+def load_cached_song(bpm: int, sample_rate: int = None):
+    """命中时返回只读的内存映射数组，未命中返回 None"""
+    path = _cache_path(song_key(bpm, sample_rate))
+    try:
+        song = np.load(path, mmap_mode="r")
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    
+    try:
+        # 更新修改时间，淘汰时按最近使用排序
+        os.utime(path)
+    except OSError:
+        pass
+    return song
+
+def _open_temp(cache_dir: str, shape):
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    return tmp_path, np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=shape)
+
+def _commit(tmp_path: str, path: str):
+    """原子重命名，多个进程同时写入同一个键时以最后一个为准"""
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Windows 下目标文件可能正被其他进程映射，内容相同，丢弃即可
+        _remove(tmp_path)
+    evict()
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def store_song(bpm: int, song: np.ndarray, sample_rate: int = None):
+    cache_dir = get_cache_dir("songs")
+    path = _cache_path(song_key(bpm, sample_rate))
+    tmp_path, mm = _open_temp(cache_dir, song.shape)
+    complete = False
+    try:
+        mm[:] = song
+        mm.flush()
+        complete = True
+    finally:
+        # 映射只释放一次；释放后 Windows 才能重命名或删除文件
+        del mm
+        if not complete:
+            _remove(tmp_path)
+    _commit(tmp_path, path)
+
+def get_song(bpm: int, sample_rate: int = None) -> np.ndarray:
+    """优先读取缓存，未命中时渲染并写入缓存"""
+    song = load_cached_song(bpm, sample_rate)
+    if song is not None:
+        return song
+    
+    events = audio.compile_melody(bpm, sample_rate=sample_rate)
+    song = audio.render_events(events, np.empty(events.total, dtype=np.float32))
+    try:
+        store_song(bpm, song, sample_rate)
+    except OSError:
+        pass
+    return song
+
+def iter_cached_song_blocks(bpm: int, block_size: int = None, sample_rate: int = None):
+    """命中时逐块读取内存映射；未命中时边渲染边写入缓存，全部写完才提交"""
+    block_size = audio.BLOCK_SIZE if block_size is None else block_size
+    song = load_cached_song(bpm, sample_rate)
+    if song is not None:
+        for offset in range(0, song.size, block_size):
+            yield song[offset:offset + block_size]
+        return
+    
+    events = audio.compile_melody(bpm, sample_rate=sample_rate)
+    path = _cache_path(song_key(bpm, sample_rate))
+    try:
+        tmp_path, mm = _open_temp(os.path.dirname(path), (events.total,))
+    except OSError:
+        yield from audio.iter_song_blocks(bpm, block_size, sample_rate)
+        return
+    
+    complete = False
+    try:
+        for offset in range(0, events.total, block_size):
+            # 直接渲染到映射文件中，不额外占用内存
+            block = mm[offset:offset + block_size]
+            audio.render_events(events, block, offset)
+            yield block
+        mm.flush()
+        complete = True
+    finally:
+        del mm
+        if complete:
+            _commit(tmp_path, path)
+        else:
+            _remove(tmp_path)
+
+def evict(max_bytes: int = None):
+    """按最近使用时间淘汰缓存，直到总大小不超过上限"""
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    prune_cache_dir(get_cache_dir("songs"), ".npy", max_bytes)
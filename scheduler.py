@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+生日日历调度
+从日历文件（CSV 带表头、JSONL 或 JSON 数组）读取每个人的生日、时间、祝福语和速度，
+按下一次生日的时刻放进最小堆，只睡到最近的截止时间；截止前 lead_time 秒预先渲染壁纸和歌曲（写入磁盘缓存），
+到点时交给常驻守护进程播放，守护进程没有运行时在本进程内运行
+
+时刻按本地时间换算成时间戳，墙上时钟被调整时堆里的时刻仍然正确；每次最多睡 MAX_SLEEP 秒，
+时钟向前跳（或系统休眠后唤醒）时最迟这么久之后就能发现到期的事件。时区或夏令时偏移变化时重新排队。
+醒来时过期不超过 missed_grace 秒的事件补放，更早的记为错过
+"""
+
+import argparse
+import calendar
+import csv
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+import tracing
+from config import ConfigError, get_config
+
+DEFAULT_TIME = "09:00"
+DEFAULT_TEMPLATE = "{name}，生日快乐！"
+# 单次睡眠的上限（秒），用来发现墙上时钟的跳变和休眠
+MAX_SLEEP = 60.0
+# 墙上时钟与单调时钟的差超过这么多秒时认为时钟被调整过
+CLOCK_JUMP = 2.0
+
+class Birthday(NamedTuple):
+    name: str
+    month: int
+    day: int
+    hour: int
+    minute: int
+    message: str
+    bpm: int
+
+def _parse_date(value: str):
+    """接受 MM-DD 或 YYYY-MM-DD（年份忽略），返回 (月, 日)"""
+    parts = [int(p) for p in value.strip().replace("/", "-").split("-")]
+    if len(parts) == 3:
+        parts = parts[1:]
+    if len(parts) != 2:
+        raise ValueError(f"日期应为 MM-DD 或 YYYY-MM-DD，实际是 {value!r}")
+    month, day = parts
+    # 用闰年检查，2 月 29 日是合法的生日
+    if not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(2000, month)[1]:
+        raise ValueError(f"不存在的日期: {value!r}")
+    return month, day
+
+def _parse_time(value: str):
+    hour, minute = (int(p) for p in value.strip().split(":"))
+    if not 0 <= hour <= 23 or not 0 <= minute <= 59:
+        raise ValueError(f"时间应为 HH:MM，实际是 {value!r}")
+    return hour, minute
+
+def read_calendar(path: str, bpm: int = 90, template: str = DEFAULT_TEMPLATE):
+    """读取日历，返回 [Birthday, ...]；字段 name、date 必填，time、message、bpm 可选
+    
+    有不合法的行时抛出 ValueError，一次列出所有问题。
+    """
+    lower = path.lower()
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if lower.endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif lower.endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+    
+    birthdays = []
+    problems = []
+    for number, row in enumerate(rows, 1):
+        try:
+            name = str(row.get("name") or "").strip()
+            if not name:
+                raise ValueError("缺少 name")
+            month, day = _parse_date(str(row.get("date") or ""))
+            hour, minute = _parse_time(str(row.get("time") or DEFAULT_TIME))
+            message = str(row.get("message") or "").strip() or template.format(name=name)
+            row_bpm = int(row.get("bpm") or bpm)
+            if not 20 <= row_bpm <= 400:
+                raise ValueError(f"bpm 应在 20 到 400 之间，实际是 {row_bpm}")
+        except (ValueError, TypeError, AttributeError) as e:
+            problems.append(f"第 {number} 条: {e}")
+            continue
+        birthdays.append(Birthday(name, month, day, hour, minute, message, row_bpm))
+    if problems:
+        raise ValueError(f"{path} 中有不合法的条目:\n  " + "\n  ".join(problems))
+    return birthdays
+
+def next_occurrence(birthday: Birthday, after: float) -> float:
+    """返回不早于 after 的下一次生日时刻（本地时间的时间戳）；非闰年的 2 月 29 日按 2 月 28 日"""
+    year = datetime.fromtimestamp(after).year
+    while True:
+        day = min(birthday.day, calendar.monthrange(year, birthday.month)[1])
+        when = datetime(year, birthday.month, day, birthday.hour, birthday.minute).timestamp()
+        if when >= after:
+            return when
+        year += 1
+
+def _utc_offset() -> int:
+    return time.localtime().tm_gmtoff
+
+def prepare_birthday(birthday: Birthday, config: dict):
+    """预先渲染壁纸和歌曲并写入磁盘缓存，到点时播放不必再渲染"""
+    from render_cache import get_song
+    from screen import get_screen_size
+    from wallpaper_cache import get_wallpaper
+    
+    get_wallpaper(birthday.message, config.get("encoder_profile"), size=get_screen_size())
+    sample_rate = config.get("sample_rate")
+    if sample_rate is None:
+        # 与 main.py 一样按设备的原生采样率渲染，缓存键才能对上
+        from playback import AudioBackendError, negotiate_format
+        try:
+            sample_rate = negotiate_format().sample_rate
+        except AudioBackendError as e:
+            return
+    get_song(birthday.bpm, sample_rate)
+
+def play_birthday(birthday: Birthday, config: dict):
+    """交给常驻守护进程播放，守护进程没有运行时在本进程内运行"""
+    from daemon import DaemonError, trigger
+    try:
+        if trigger(birthday.message, birthday.bpm).get("ok"):
+            return
+    except DaemonError as e:
+        pass
+    from main import run_pipeline
+    run_pipeline(dict(config, message=birthday.message, bpm=birthday.bpm))
+
+class Scheduler:
+    """以 (时刻, 序号, 类型, 生日) 为元素的最小堆，类型为 "prepare"（预渲染）或 "fire"（播放）"""
+    
+    def __init__(self, birthdays, config: dict = None, play=play_birthday, prepare=prepare_birthday,
+                 source: str = None):
+        self.config = get_config() if config is None else config
+        self.lead_time = self.config["lead_time"]
+        self.grace = self.config["missed_grace"]
+        self.play = play
+        self.prepare = prepare
+        self.source = source
+        self._source_stamp = self._stamp()
+        self._seq = itertools.count()
+        self._heap = []
+        # 已经播放过的 (生日, 年份)，时钟回拨或重新排队后不会重复播放
+        self._fired = set()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._prerender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prerender")
+        self._player = ThreadPoolExecutor(max_workers=1, thread_name_prefix="player")
+        self.stats = {"prepared": 0, "fired": 0, "late": 0, "missed": 0, "clock_jumps": 0, "reloads": 0}
+        self.reschedule(birthdays)
+    
+    def _stamp(self):
+        if self.source is None:
+            return None
+        try:
+            st = os.stat(self.source)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+    
+    def _push(self, birthday: Birthday, when: float):
+        heapq.heappush(self._heap, (when - self.lead_time, next(self._seq), "prepare", birthday, when))
+        heapq.heappush(self._heap, (when, next(self._seq), "fire", birthday, when))
+    
+    def reschedule(self, birthdays=None, now: float = None):
+        """重新计算所有生日的下一次时刻；过期不超过 grace 的也放进来，醒来后补放"""
+        now = time.time() if now is None else now
+        if birthdays is not None:
+            self.birthdays = list(birthdays)
+        self._offset = _utc_offset()
+        self._heap = []
+        for birthday in self.birthdays:
+            self._push(birthday, next_occurrence(birthday, now - self.grace))
+        self._wake.set()
+    
+    def upcoming(self, count: int = 10):
+        """最近的 count 次播放：[(时刻, Birthday), ...]"""
+        fires = [(when, b) for _, _, kind, b, when in self._heap if kind == "fire"]
+        return heapq.nsmallest(count, fires, key=lambda item: item[0])
+    
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+    
+    def run_due(self, now: float = None) -> int:
+        """处理所有到期的事件，返回处理的个数"""
+        now = time.time() if now is None else now
+        handled = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, _, kind, birthday, when = heapq.heappop(self._heap)
+            handled += 1
+            if kind == "prepare":
+                # 播放时刻也已经过了太久的不再预渲染，由 fire 记为错过
+                if now - when <= self.grace:
+                    self._prerender.submit(self._run, "scheduler.prepare", self.prepare, birthday)
+                    self.stats["prepared"] += 1
+                continue
+            
+            # 按年份而不是时间戳去重，时区变化后重新排队的同一次生日不会再播一遍
+            key = (birthday, datetime.fromtimestamp(when).year)
+            if key not in self._fired:
+                late = now - when
+                if late > self.grace:
+                    self.stats["missed"] += 1
+                    print(f"错过了 {birthday.name} 的生日（晚了 {late:.0f} 秒）", file=sys.stderr)
+                else:
+                    if late > MAX_SLEEP:
+                        self.stats["late"] += 1
+                    self._fired.add(key)
+                    self._player.submit(self._run, "scheduler.fire", self.play, birthday)
+                    self.stats["fired"] += 1
+            # 排下一年的同一天
+            self._push(birthday, next_occurrence(birthday, when + 1))
+        return handled
+    
+    def _run(self, name: str, func, birthday: Birthday):
+        try:
+            with tracing.span(name, person=birthday.name, bpm=birthday.bpm):
+                func(birthday, self.config)
+        except Exception as e:
+            tracing.error(name, e, person=birthday.name)
+            print(f"{birthday.name}: {type(e).__name__}: {e}", file=sys.stderr)
+    
+    def _check_changes(self, wall_start: float, mono_start: float):
+        """醒来后检查时钟跳变、时区变化和日历文件的修改"""
+        drift = (time.time() - wall_start) - (time.monotonic() - mono_start)
+        if abs(drift) > CLOCK_JUMP:
+            # 堆里是绝对时间戳，跳变本身不影响顺序；向前跳过的事件由 run_due 按是否超过 grace 处理
+            self.stats["clock_jumps"] += 1
+            print(f"系统时钟变化了 {drift:+.0f} 秒", file=sys.stderr)
+        if _utc_offset() != self._offset:
+            # 时区或夏令时偏移变了，本地时间对应的时间戳需要重算
+            self.reschedule()
+        stamp = self._stamp()
+        if stamp != self._source_stamp:
+            self._source_stamp = stamp
+            try:
+                birthdays = read_calendar(self.source, self.config["bpm"])
+            except (OSError, ValueError) as e:
+                print(f"日历未重新加载: {e}", file=sys.stderr)
+                return
+            self.stats["reloads"] += 1
+            self.reschedule(birthdays)
+    
+    def run(self):
+        """处理到期事件并睡到下一个截止时间，直到 stop()"""
+        while not self._stopped:
+            self.run_due()
+            deadline = self.next_deadline()
+            timeout = MAX_SLEEP if deadline is None else min(max(deadline - time.time(), 0.0), MAX_SLEEP)
+            wall_start, mono_start = time.time(), time.monotonic()
+            self._wake.clear()
+            self._wake.wait(timeout)
+            self._check_changes(wall_start, mono_start)
+    
+    def stop(self, wait: bool = True):
+        self._stopped = True
+        self._wake.set()
+        self._prerender.shutdown(wait=wait)
+        self._player.shutdown(wait=wait)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按生日日历自动播放生日歌并设置壁纸")
+    parser.add_argument("calendar", nargs="?", default=None, help="日历文件，默认取配置项 calendar")
+    parser.add_argument("--lead", type=float, default=None, help="提前预渲染的秒数，默认取配置项 lead_time")
+    parser.add_argument("--grace", type=float, default=None, help="错过后仍然补放的最长秒数，默认取配置项 missed_grace")
+    parser.add_argument("--list", type=int, default=None, metavar="N", help="只列出最近的 N 次生日")
+    args = parser.parse_args(argv)
+    
+    try:
+        config = get_config()
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        return False
+    path = args.calendar or config.get("calendar")
+    if not path:
+        parser.error("需要日历文件（参数或配置项 calendar）")
+    path = os.path.expanduser(path)
+    if args.lead is not None:
+        config["lead_time"] = args.lead
+    if args.grace is not None:
+        config["missed_grace"] = args.grace
+    tracing.configure(config.get("trace"))
+    
+    try:
+        birthdays = read_calendar(path, config["bpm"])
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return False
+    
+    scheduler = Scheduler(birthdays, config, source=path)
+    if args.list is not None:
+        for when, birthday in scheduler.upcoming(args.list):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(when))}  {birthday.name}  {birthday.message}")
+        scheduler.stop()
+        return True
+    
+    print(f"已载入 {len(birthdays)} 个生日", file=sys.stderr)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    scheduler.stop(wait=False)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,362 @@
+"""
+乐谱文件
+支持简单的文本 / JSON 乐谱和标准 MIDI 文件。乐谱一次性编译成连续的 NumPy 数组
+（起始采样、采样长度、十二平均律频率、力度），由 mixer 直接按数组逐块渲染；
+编译结果按文件内容缓存为 .npz，再次加载时不必重新解析
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+
+import audio
+import mixer
+from config import get_cache_dir, prune_cache_dir
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+# 编译结果的格式或算法改变时递增，使旧缓存失效
+SCORE_VERSION = 1
+MIDI_SUFFIXES = (".mid", ".midi")
+
+class Score(NamedTuple):
+    """解析后的乐谱，每个音符一项；时间单位是拍（文本 / JSON）或秒（MIDI）"""
+    onset: np.ndarray
+    duration: np.ndarray
+    pitch: np.ndarray     # MIDI 音符号，可以是小数
+    velocity: np.ndarray  # 0 ~ 1，已乘上声部音量
+    voice: np.ndarray
+    unit: str
+    bpm: float = None
+
+def _pitch(note) -> float:
+    if isinstance(note, (int, float)):
+        return float(note)
+    return float(audio.note_number(str(note)))
+
+def from_voices(voices, bpm: float = None) -> Score:
+    """由 (音符列表, 音量) 的声部列表构造乐谱，音符是 (音名, 拍数[, 力度])
+    
+    mixer.Voice 也是这种结构，所以 from_voices(mixer.DEFAULT_SCORE) 可以直接使用。
+    """
+    onset, duration, pitch, velocity, voice = [], [], [], [], []
+    for index, (notes, gain) in enumerate(voices):
+        t = 0.0
+        for entry in notes:
+            note, beats = entry[0], float(entry[1])
+            if str(note).upper() != "REST":
+                onset.append(t)
+                duration.append(beats)
+                pitch.append(_pitch(note))
+                velocity.append((float(entry[2]) if len(entry) > 2 else 1.0) * gain)
+                voice.append(index)
+            t += beats
+    return Score(
+        onset=np.array(onset, dtype=np.float64),
+        duration=np.array(duration, dtype=np.float64),
+        pitch=np.array(pitch, dtype=np.float64),
+        velocity=np.array(velocity, dtype=np.float64),
+        voice=np.array(voice, dtype=np.int64),
+        unit="beats",
+        bpm=bpm,
+    )
+
+def parse_text(text: str) -> Score:
+    """文本乐谱：每行一个音符 "音名 拍数 [力度]"，REST 为休止；
+    "voice [音量]" 开始一个新声部，"bpm 数值" 指定速度，# 之后为注释（C#4 中的 # 除外）
+    """
+    voices = []
+    bpm = None
+    for lineno, raw in enumerate(text.splitlines(), 1):
+        tokens = re.split(r"(?:^|\s)#", raw, maxsplit=1)[0].split()
+        if not tokens:
+            continue
+        try:
+            keyword = tokens[0].lower()
+            if keyword == "bpm":
+                bpm = float(tokens[1])
+            elif keyword == "voice":
+                voices.append(([], float(tokens[1]) if len(tokens) > 1 else 1.0))
+            else:
+                if not voices:
+                    voices.append(([], 1.0))
+                if keyword != "rest":
+                    _pitch(tokens[0])  # 尽早报告无效音名及其行号
+                voices[-1][0].append((tokens[0], float(tokens[1]), *map(float, tokens[2:3])))
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"乐谱第 {lineno} 行无法解析: {raw.strip()!r}") from e
+    return from_voices(voices, bpm)
+
+def parse_json(data) -> Score:
+    """JSON 乐谱：{"bpm": 90, "voices": [{"gain": 1.0, "notes": [["G4", 0.75], ...]}]}，
+    只有一个声部时可以直接写 {"notes": [...]} 或音符列表本身
+    """
+    if isinstance(data, list):
+        data = {"notes": data}
+    voices = data.get("voices") or [{"notes": data.get("notes", [])}]
+    return from_voices([(v["notes"], float(v.get("gain", 1.0))) for v in voices], data.get("bpm"))
+
+def _read_varlen(data: bytes, pos: int):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def _read_track(data: bytes, pos: int, end: int, track: int, notes: list, tempos: list):
+    tick = 0
+    status = None
+    pending = {}  # (通道, 音符号) -> [(起始 tick, 力度), ...]
+    while pos < end:
+        delta, pos = _read_varlen(data, pos)
+        tick += delta
+        byte = data[pos]
+        
+        if byte == 0xFF:
+            kind = data[pos + 1]
+            size, pos = _read_varlen(data, pos + 2)
+            if kind == 0x51 and size == 3:
+                tempos.append((tick, int.from_bytes(data[pos:pos + 3], "big")))
+            pos += size
+            if kind == 0x2F:
+                break
+            continue
+        if byte in (0xF0, 0xF7):
+            size, pos = _read_varlen(data, pos + 1)
+            pos += size
+            continue
+        
+        # 省略状态字节时沿用上一个（running status）
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        elif status is None:
+            raise ValueError("MIDI 轨道缺少状态字节")
+        kind, channel = status & 0xF0, status & 0x0F
+        if kind in (0xC0, 0xD0):
+            pos += 1
+            continue
+        key, velocity = data[pos], data[pos + 1]
+        pos += 2
+        
+        if kind == 0x90 and velocity > 0:
+            pending.setdefault((channel, key), []).append((tick, velocity))
+        elif kind in (0x80, 0x90):
+            started = pending.get((channel, key))
+            if started:
+                on, on_velocity = started.pop(0)
+                if tick > on:
+                    notes.append((on, tick, key, on_velocity, track * 16 + channel))
+
+def parse_midi(data: bytes) -> Score:
+    """读取标准 MIDI 文件（格式 0 / 1）中的音符和速度变化，时间换算成秒"""
+    if data[:4] != b"MThd" or len(data) < 14:
+        raise ValueError("不是标准 MIDI 文件")
+    header_size, _, _, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        raise ValueError("不支持 SMPTE 时间码的 MIDI 文件")
+    
+    notes, tempos = [], []
+    pos = 8 + header_size
+    track = 0
+    while pos + 8 <= len(data):
+        chunk, size = data[pos:pos + 4], struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        pos += 8
+        if chunk == b"MTrk":
+            _read_track(data, pos, min(pos + size, len(data)), track, notes, tempos)
+            track += 1
+        pos += size
+    
+    # 速度表：每段的起始 tick、起始秒数和每 tick 的秒数，默认 120 bpm
+    tempos = sorted(dict([(0, 500_000)] + tempos).items())
+    tempo_tick = np.array([t for t, _ in tempos], dtype=np.float64)
+    tick_seconds = np.array([us for _, us in tempos], dtype=np.float64) / 1e6 / division
+    tempo_start = np.concatenate([[0.0], np.cumsum(np.diff(tempo_tick) * tick_seconds[:-1])])
+    
+    def seconds(ticks):
+        i = np.searchsorted(tempo_tick, ticks, side="right") - 1
+        return tempo_start[i] + (ticks - tempo_tick[i]) * tick_seconds[i]
+    
+    table = np.array(notes, dtype=np.float64).reshape(-1, 5)
+    onset, end = seconds(table[:, 0]), seconds(table[:, 1])
+    return Score(
+        onset=onset,
+        duration=end - onset,
+        pitch=table[:, 2],
+        velocity=table[:, 3] / 127,
+        voice=table[:, 4].astype(np.int64),
+        unit="seconds",
+        bpm=60e6 / tempos[0][1],
+    )
+
+def parse_score(path: str, data: bytes = None) -> Score:
+    """按扩展名选择解析器：.mid/.midi 为 MIDI，.json 为 JSON，其余按文本乐谱解析"""
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in MIDI_SUFFIXES:
+        return parse_midi(data)
+    text = data.decode("utf-8-sig")
+    if suffix == ".json":
+        return parse_json(json.loads(text))
+    return parse_text(text)
+
+def compile_events(score: Score, bpm: float = None, sample_rate: int = None,
+                   transpose: float = 0, default_bpm: float = None) -> mixer.ScoreEvents:
+    """把乐谱编译成 mixer 可以直接渲染的事件数组，全程没有逐音符的 Python 循环
+    
+    bpm 只对以拍为单位的乐谱有效：显式传入的值优先，其次是乐谱自带的速度，最后是 default_bpm。
+    同一声部中首尾相接的音符相位连续，避免接缝处的爆音。
+    """
+    sample_rate = audio.SAMPLE_RATE if sample_rate is None else sample_rate
+    if score.unit == "beats":
+        bpm = bpm or score.bpm or default_bpm
+        if not bpm:
+            raise ValueError("乐谱没有指定速度（bpm）")
+        seconds = 60 / bpm
+    else:
+        seconds = 1.0
+    
+    start = np.rint(score.onset * seconds * sample_rate).astype(np.int64)
+    end = np.rint((score.onset + score.duration) * seconds * sample_rate).astype(np.int64)
+    keep = end > start
+    voice = score.voice[keep]
+    start, end = start[keep], end[keep]
+    
+    # 按 (声部, 起始) 排序后，首尾相接的音符组成一段，段内相位累加
+    order = np.lexsort((start, voice))
+    voice, start, end = voice[order], start[order], end[order]
+    length = end - start
+    freq = audio.midi_frequency(score.pitch[keep][order] + transpose)
+    advance = 2 * np.pi * freq / sample_rate * length
+    before = np.cumsum(advance) - advance
+    joined = (voice[1:] == voice[:-1]) & (start[1:] == end[:-1])
+    head = np.maximum.accumulate(np.where(np.concatenate([[True], ~joined]), np.arange(start.size), 0))
+    phase = np.mod(before - before[head], 2 * np.pi)
+    
+    freqs, pitch = np.unique(freq, return_inverse=True)
+    return mixer.ScoreEvents(
+        start=start,
+        end=end,
+        length=length,
+        pitch=pitch.ravel(),
+        phase=phase,
+        gain=score.velocity[keep][order] * audio.VOLUME,
+        freqs=tuple(float(f) for f in freqs),
+        sample_rate=sample_rate,
+        total=int(end.max()) if end.size else 0,
+    )
+
+def _cache_path(data: bytes, bpm, sample_rate: int, transpose: float, default_bpm=None) -> str:
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps({
+        "version": SCORE_VERSION,
+        "bpm": bpm,
+        "default_bpm": default_bpm,
+        "sample_rate": sample_rate,
+        "transpose": transpose,
+        "volume": audio.VOLUME,
+    }, sort_keys=True).encode("utf-8"))
+    return os.path.join(get_cache_dir("scores"), f"{digest.hexdigest()}.npz")
+
+def _load_cached(cache_path: str):
+    try:
+        with np.load(cache_path) as z:
+            events = mixer.ScoreEvents(
+                start=z["start"], end=z["end"], length=z["length"], pitch=z["pitch"],
+                phase=z["phase"], gain=z["gain"], freqs=tuple(z["freqs"].tolist()),
+                sample_rate=int(z["sample_rate"]), total=int(z["total"]),
+            )
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return events
+
+def _store(cache_path: str, events: mixer.ScoreEvents):
+    cache_dir = os.path.dirname(cache_path)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            fields = events._asdict()
+            fields["freqs"] = np.array(events.freqs)
+            np.savez(f, **fields)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+    prune_cache_dir(cache_dir, ".npz", MAX_CACHE_BYTES)
+
+def load_events(path: str, bpm: float = None, sample_rate: int = None,
+                transpose: float = 0, default_bpm: float = None) -> mixer.ScoreEvents:
+    """读取乐谱文件并编译；同样的文件内容和参数直接读取缓存的编译结果"""
+    sample_rate = audio.SAMPLE_RATE if sample_rate is None else sample_rate
+    with open(path, "rb") as f:
+        data = f.read()
+    
+    try:
+        cache_path = _cache_path(data, bpm, sample_rate, transpose, default_bpm)
+    except OSError:
+        cache_path = None
+    if cache_path is not None:
+        events = _load_cached(cache_path)
+        if events is not None:
+            return events
+    
+    events = compile_events(parse_score(path, data), bpm, sample_rate, transpose, default_bpm)
+    if cache_path is not None:
+        _store(cache_path, events)
+    return events
+
+def iter_file_blocks(path: str, bpm: float = None, block_size: int = None, sample_rate: int = None,
+                     default_bpm: float = None):
+    return mixer.iter_blocks(load_events(path, bpm, sample_rate, default_bpm=default_bpm), block_size)
+
+def benchmark(repeat: int = 3, copies: int = 200):
+    """把生日歌重复 copies 遍作为长乐谱，对比逐音符渲染与编译数组渲染的耗时"""
+    import time
+    
+    melody = audio.MELODY * copies
+    text = "\n".join(f"{note} {beats}" for note, beats in melody)
+    
+    def best(func):
+        result = float("inf")
+        for _ in range(repeat):
+            audio.waveform_cache.clear()
+            start = time.perf_counter()
+            func()
+            result = min(result, time.perf_counter() - start)
+        return result
+    
+    def per_note():
+        events = audio.compile_melody(90, melody)
+        audio.render_events(events, np.empty(events.total, dtype=np.float32))
+    
+    events = compile_events(parse_text(text), 90)
+    cases = {
+        "解析 + 编译": lambda: compile_events(parse_text(text), 90),
+        "compile_melody + render_events": per_note,
+        "mixer.render（已编译）": lambda: mixer.render(events),
+    }
+    results = {}
+    for name, func in cases.items():
+        results[name] = best(func)
+        print(f"{name}: {results[name] * 1000:.1f}ms")
+    print(f"{len(melody)} 个音符，{events.total / audio.SAMPLE_RATE:.0f} 秒")
+    return results
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,179 @@
+"""
+屏幕分辨率探测
+按平台选择最快的方式，不再为了取分辨率启动 Tk；结果在进程内缓存
+优先级：config.json 的 screen_size > 环境变量 BIRTHDAY_SCREEN_SIZE > 平台探测 > 默认值
+"""
+
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+
+DEFAULT_SIZE = (1920, 1080)
+PROBE_TIMEOUT = 2
+
+_screen_size = None
+
+def parse_size(value):
+    """接受 [宽, 高]、(宽, 高) 或 "宽x高"，无效时返回 None"""
+    if isinstance(value, str):
+        match = re.fullmatch(r"\s*(\d+)\s*[xX×*,]\s*(\d+)\s*", value)
+        if not match:
+            return None
+        value = (match.group(1), match.group(2))
+    try:
+        width, height = (int(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return width, height
+
+def _run(cmd):
+    """执行探测命令，命令不存在或超时时返回 None"""
+    if shutil.which(cmd[0]) is None:
+        return None
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+def _probe_xrandr():
+    if not os.environ.get("DISPLAY"):
+        return None
+    output = _run(["xrandr", "--current"])
+    if not output:
+        return None
+    # 优先取主显示器当前模式，其次取任意已连接输出的当前模式
+    match = re.search(r" connected primary (\d+)x(\d+)\+", output) \
+        or re.search(r" connected (\d+)x(\d+)\+", output) \
+        or re.search(r"current (\d+) x (\d+)", output)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def _probe_wayland():
+    if not os.environ.get("WAYLAND_DISPLAY"):
+        return None
+    output = _run(["wlr-randr"])
+    if output:
+        match = re.search(r"(\d+)x(\d+) px, [\d.]+ Hz \([^)]*current", output)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    output = _run(["swaymsg", "-t", "get_outputs", "-r"])
+    if output:
+        try:
+            for out in json.loads(output):
+                mode = out.get("current_mode") or {}
+                if out.get("active") and mode.get("width"):
+                    return mode["width"], mode["height"]
+        except (ValueError, AttributeError):
+            pass
+    return None
+
+def _probe_drm():
+    """读取内核 DRM 的已连接输出，不需要任何子进程；modes 第一行是首选模式"""
+    for status_path in sorted(glob.glob("/sys/class/drm/card*-*/status")):
+        try:
+            with open(status_path, "r") as f:
+                if f.read().strip() != "connected":
+                    continue
+            with open(os.path.join(os.path.dirname(status_path), "modes"), "r") as f:
+                size = parse_size(f.readline().strip())
+        except OSError:
+            continue
+        if size:
+            return size
+    return None
+
+def _probe_windows():
+    import ctypes
+    # DESKTOPHORZRES / DESKTOPVERTRES 返回物理像素，不受 DPI 缩放影响
+    user32 = ctypes.windll.user32
+    gdi32 = ctypes.windll.gdi32
+    # HDC 是指针，默认的 int 返回值在 64 位系统上会被截断
+    user32.GetDC.argtypes = [ctypes.c_void_p]
+    user32.GetDC.restype = ctypes.c_void_p
+    user32.ReleaseDC.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    user32.ReleaseDC.restype = ctypes.c_int
+    gdi32.GetDeviceCaps.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    gdi32.GetDeviceCaps.restype = ctypes.c_int
+    hdc = user32.GetDC(None)
+    try:
+        width = gdi32.GetDeviceCaps(hdc, 118)
+        height = gdi32.GetDeviceCaps(hdc, 117)
+    finally:
+        user32.ReleaseDC(None, hdc)
+    if width > 0 and height > 0:
+        return width, height
+    return user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+
+def _probe_macos():
+    import ctypes
+    try:
+        cg = ctypes.cdll.LoadLibrary(
+            "/System/Library/Frameworks/CoreGraphics.framework/CoreGraphics")
+        cg.CGMainDisplayID.restype = ctypes.c_uint32
+        cg.CGDisplayCopyDisplayMode.argtypes = [ctypes.c_uint32]
+        cg.CGDisplayCopyDisplayMode.restype = ctypes.c_void_p
+        cg.CGDisplayModeGetPixelWidth.argtypes = [ctypes.c_void_p]
+        cg.CGDisplayModeGetPixelWidth.restype = ctypes.c_size_t
+        cg.CGDisplayModeGetPixelHeight.argtypes = [ctypes.c_void_p]
+        cg.CGDisplayModeGetPixelHeight.restype = ctypes.c_size_t
+        cg.CGDisplayModeRelease.argtypes = [ctypes.c_void_p]
+        
+        mode = cg.CGDisplayCopyDisplayMode(cg.CGMainDisplayID())
+        if mode:
+            try:
+                # 像素尺寸，Retina 屏上是逻辑尺寸的两倍
+                return cg.CGDisplayModeGetPixelWidth(mode), cg.CGDisplayModeGetPixelHeight(mode)
+            finally:
+                cg.CGDisplayModeRelease(mode)
+    except (OSError, AttributeError):
+        pass
+    
+    output = _run(["osascript", "-e", 'tell application "Finder" to get bounds of window of desktop'])
+    if output:
+        values = [int(v) for v in re.findall(r"-?\d+", output)]
+        if len(values) == 4:
+            return values[2] - values[0], values[3] - values[1]
+    return None
+
+def get_probes():
+    """当前平台按顺序尝试的探测函数"""
+    system = platform.system()
+    if system == "Windows":
+        return [_probe_windows]
+    elif system == "Darwin":
+        return [_probe_macos]
+    return [_probe_xrandr, _probe_wayland, _probe_drm]
+
+def detect_screen_size():
+    for probe in get_probes():
+        try:
+            size = probe()
+        except Exception as e:
+            continue
+        size = parse_size(size) if size else None
+        if size:
+            return size
+    return None
+
+def _configured_size():
+    try:
+        from config import get_config
+        size = parse_size(get_config().get("screen_size"))
+        if size:
+            return size
+    except Exception as e:
+        pass
+    return parse_size(os.environ.get("BIRTHDAY_SCREEN_SIZE", ""))
+
+def get_screen_size(refresh: bool = False):
+    """返回 (宽, 高)；同一进程内只探测一次，refresh=True 时重新探测"""
+    global _screen_size
+    if _screen_size is None or refresh:
+        _screen_size = _configured_size() or detect_screen_size() or DEFAULT_SIZE
+    return _screen_size
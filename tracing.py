@@ -0,0 +1,190 @@
+"""
+阶段耗时追踪
+用环境变量 BIRTHDAY_TRACE 或 config.json 的 "trace" 开启：值为 1/true 时写入缓存目录下的 traces/，
+否则视为输出路径。记录各阶段的时间段、被吞掉的异常和进程的内存峰值，
+输出 Chrome trace-event 格式的 JSON（可以用 chrome://tracing 或 Perfetto 打开，也可以直接读）
+
+未开启时 span() 返回共享的空对象，traced() 包装的函数只多一次标志判断
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+_TRUE = ("1", "true", "yes", "on")
+
+_enabled = False
+_path = None
+_events = []
+_threads = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+def _peak_rss():
+    """进程的内存峰值（字节），无法获取时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 为单位，macOS 以字节为单位
+        return peak if sys.platform == "darwin" else peak * 1024
+    
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+        
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+def _us(t: float) -> float:
+    return round((t - _origin) * 1e6, 1)
+
+def _append(event: dict):
+    tid = threading.get_ident()
+    event["pid"] = os.getpid()
+    event["tid"] = tid
+    with _lock:
+        if tid not in _threads:
+            _threads[tid] = threading.current_thread().name
+        _events.append(event)
+
+def complete(name: str, start: float, end: float, **args):
+    """记录一个已经结束的时间段，start / end 是 time.perf_counter() 的值"""
+    if not _enabled:
+        return
+    _append({"name": name, "cat": name.split(".", 1)[0], "ph": "X",
+             "ts": _us(start), "dur": round((end - start) * 1e6, 1), "args": args})
+    peak = _peak_rss()
+    if peak is not None:
+        _append({"name": "memory", "ph": "C", "ts": _us(end), "args": {"peak_rss_mb": round(peak / 2 ** 20, 1)}})
+
+def error(name: str, exc: BaseException, **args):
+    """记录一个被捕获、没有继续抛出的异常"""
+    if not _enabled:
+        return
+    _append({"name": name, "cat": "error", "ph": "i", "s": "t", "ts": _us(time.perf_counter()),
+             "args": dict(args, error=f"{type(exc).__name__}: {exc}")})
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+    
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        complete(self.name, self.start, time.perf_counter(), **self.args)
+        return False
+    
+    def set(self, **args):
+        """给时间段补充参数（例如缓存是否命中）"""
+        self.args.update(args)
+
+class _NullSpan:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, **args):
+    """with tracing.span("wallpaper.encode"): ...；未开启时返回共享的空对象"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+def traced(name: str):
+    """把整个函数记录为一个时间段的装饰器"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def is_enabled() -> bool:
+    return _enabled
+
+def _default_path() -> str:
+    from config import get_cache_dir
+    return os.path.join(get_cache_dir("traces"), time.strftime("trace_%Y%m%d_%H%M%S.json"))
+
+def enable(path: str = None):
+    """开始记录；path 为空时写入缓存目录。进程退出时自动写出"""
+    global _enabled, _path
+    _path = path or _default_path()
+    if not _enabled:
+        _enabled = True
+        atexit.register(finish)
+
+def configure(setting=None) -> bool:
+    """按环境变量 BIRTHDAY_TRACE（优先）或配置项 "trace" 开启，返回是否已开启"""
+    value = os.environ.get("BIRTHDAY_TRACE")
+    if value is None:
+        value = setting
+    if value is None or value is False or str(value).strip().lower() in ("", "0", "false", "no", "off"):
+        return _enabled
+    enable(None if value is True or str(value).strip().lower() in _TRUE else os.path.expanduser(str(value)))
+    return True
+
+def finish():
+    """写出追踪文件并返回路径；未开启或已写出时返回 None"""
+    global _enabled
+    if not _enabled:
+        return None
+    _enabled = False
+    with _lock:
+        events = list(_events)
+        _events.clear()
+        names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                 for tid, name in _threads.items()]
+    peak = _peak_rss()
+    trace = {
+        "traceEvents": names + events,
+        "displayTimeUnit": "ms",
+        "otherData": {"argv": sys.argv, "peak_rss_mb": round(peak / 2 ** 20, 1) if peak else None},
+    }
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(_path)), exist_ok=True)
+        with open(_path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"无法写入追踪文件 {_path}: {e}", file=sys.stderr)
+        return None
+    print(f"追踪文件: {_path}", file=sys.stderr)
+    return _path
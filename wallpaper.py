@@ -1,10 +1,20 @@
 import os
-import sys
 import subprocess
 import platform
 import time
-import uuid
-from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+import desktop
+import encoders
+import tracing
+from screen import get_screen_size
+# PIL、numpy 以及依赖它们的 base_image、gradient 只在真正绘制壁纸时导入，
+# 命中壁纸缓存时只需设置壁纸，不必加载这些库
+
+# 找不到底图时使用的渐变色标
+FALLBACK_GRADIENT = [(0.0, (26, 26, 46)), (1.0, (46, 46, 66))]
+FONT_SIZE = 80
+
+_dispatcher = None
 
 def get_system_fonts():
     """获取系统中可用的字体路径（楷体相关）"""
@@ -27,97 +37,77 @@ def get_system_fonts():
         ]
     else:  # Linux等其他系统
         font_paths = [
+            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",   # 思源黑体
+            "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",          # 文泉驿微米黑
             "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
             "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
         ]
     
     return font_paths
 
-def create_wallpaper(message: str, output_path: str = None):
-    # 生成唯一的文件名避免冲突
-    if output_path is None:
-        timestamp = int(time.time())
-        unique_id = str(uuid.uuid4())[:8]
-        output_path = f"birthday_wallpaper_{timestamp}_{unique_id}.png"
-    
-    # 尝试加载底图 - 多种路径查找策略
-    base_image_paths = []
-    
-    # PyInstaller打包后的路径处理
-    if hasattr(sys, '_MEIPASS'):
-        # 打包后的临时目录
-        base_image_paths.append(os.path.join(sys._MEIPASS, "wallpaper_basic.png"))
+@tracing.traced("wallpaper.font_lookup")
+def find_font_path(message: str = None):
+    """返回能显示 message 的字体路径（查字体索引），找不到时返回第一个存在的常用字体"""
+    if message:
+        try:
+            from fonts import find_font_for_text
+            font_path = find_font_for_text(message, preferred=get_system_fonts())
+            if font_path is not None:
+                return font_path
+        except Exception as e:
+            pass
     
-    # 当前工作目录
-    base_image_paths.append("wallpaper_basic.png")
+    for font_path in get_system_fonts():
+        if os.path.exists(font_path):
+            return font_path
+    return None
+
+def load_font(font_size: int = FONT_SIZE, message: str = None):
+    from PIL import ImageFont
     
-    # 脚本所在目录
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    base_image_paths.append(os.path.join(script_dir, "wallpaper_basic.png"))
+    font_path = find_font_path(message)
+    if font_path is not None:
+        try:
+            with tracing.span("wallpaper.font_load", path=font_path):
+                return ImageFont.truetype(font_path, font_size)
+        except Exception as e:
+            pass
     
-    # 可执行文件所在目录（对于打包后的exe）
-    if hasattr(sys, 'frozen'):
-        exe_dir = os.path.dirname(sys.executable)
-        base_image_paths.append(os.path.join(exe_dir, "wallpaper_basic.png"))
+    try:
+        for font_path in get_system_fonts():
+            if os.path.exists(font_path):
+                try:
+                    return ImageFont.truetype(font_path, font_size)
+                except Exception as e:
+                    continue
+    except Exception as e:
+        pass
     
-    image = None
-    base_image_path = None
+    return ImageFont.load_default()
+
+def create_wallpaper_image(message: str, size=None):
+    """在底图上绘制文字，返回未编码的图像"""
+    from base_image import load_base_image
+    from gradient import create_gradient
     
-    # 尝试从各个路径加载底图
-    for path in base_image_paths:
-        if os.path.exists(path):
-            try:
-                image = Image.open(path)
-                base_image_path = path
-                break
-            except Exception as e:
-                continue
+    # 加载底图（优先读取解码缓存），size 为空时保持底图原尺寸
+    image = load_base_image(size)
     
     # 如果所有路径都失败，创建默认背景
     if image is None:
-        # 获取屏幕分辨率，如果失败则使用默认值
-        try:
-            import tkinter as tk
-            root = tk.Tk()
-            width = root.winfo_screenwidth()
-            height = root.winfo_screenheight()
-            root.destroy()
-        except:
-            width, height = 1920, 1080  # 默认分辨率
-        
-        # 创建渐变背景而不是纯黑色
-        image = Image.new("RGB", (width, height), color="#1a1a2e")
-        draw = ImageDraw.Draw(image)
-        
-        # 添加简单的渐变效果
-        for y in range(height):
-            color_value = int(26 + (y / height) * 20)  # 从深蓝到稍亮的蓝
-            color = (color_value, color_value, min(46 + int(y / height * 20), 80))
-            draw.line([(0, y), (width, y)], fill=color)
+        # 创建渐变背景而不是纯黑色：从深蓝到稍亮的蓝
+        image = create_gradient(size or get_screen_size(), FALLBACK_GRADIENT)
+    
+    return draw_message(image, message, load_font(FONT_SIZE, message))
+
+@tracing.traced("wallpaper.draw_text")
+def draw_message(image, message: str, font):
+    """把文字居中绘制到 image 上（带阴影）"""
+    from PIL import ImageDraw
     
     width, height = image.size
     draw = ImageDraw.Draw(image)
     
-    font_size = 80
-    font = None
-    
-    try:
-        font_paths = get_system_fonts()
-        
-        for font_path in font_paths:
-            if os.path.exists(font_path):
-                try:
-                    font = ImageFont.truetype(font_path, font_size)
-                    break
-                except Exception as e:
-                    continue
-        
-        if font is None:
-            font = ImageFont.load_default()
-            
-    except Exception as e:
-        font = ImageFont.load_default()
-    
     bbox = draw.textbbox((0, 0), message, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
@@ -129,11 +119,19 @@ def create_wallpaper(message: str, output_path: str = None):
     draw.text((x + shadow_offset, y + shadow_offset), message, fill="black", font=font)
     draw.text((x, y), message, fill="white", font=font)
     
+    return image
+
+def create_wallpaper(message: str, output_path: str = None, profile: str = None, size=None):
+    # 默认写到内存盘上的临时目录，而不是当前工作目录
+    if output_path is None:
+        output_path = encoders.temp_output_path(profile)
+    
+    image = create_wallpaper_image(message, size)
+    
     # 保存图像
-    image.save(output_path)
-    return output_path
+    return encoders.save(image, output_path, profile)
 
-def set_wallpaper_macos(image_path: str):
+def set_wallpaper_macos(image_path: str, verify: bool = False, timeout: float = desktop.COMMAND_TIMEOUT):
     try:
         abs_path = os.path.abspath(image_path)
         
@@ -151,10 +149,14 @@ def set_wallpaper_macos(image_path: str):
         result = subprocess.run(
             ["osascript", "-e", script],
             capture_output=True,
-            text=True
+            text=True,
+            timeout=timeout
         )
         
-        if result.returncode == 0:
+        # 校验需要再启动一次 osascript，默认跳过
+        if result.returncode == 0 and not verify:
+            return True
+        elif result.returncode == 0:
             verify_script = '''
             tell application "System Events"
                 tell desktop 1
@@ -166,7 +168,8 @@ def set_wallpaper_macos(image_path: str):
             verify_result = subprocess.run(
                 ["osascript", "-e", verify_script],
                 capture_output=True,
-                text=True
+                text=True,
+                timeout=timeout
             )
             
             if verify_result.returncode == 0:
@@ -227,31 +230,16 @@ def set_wallpaper_windows(image_path: str):
         except Exception as e2:
             return False
 
-def set_wallpaper_linux(image_path: str):
+def set_wallpaper_linux(image_path: str, timeout: float = desktop.COMMAND_TIMEOUT):
     """未测试"""
     try:
-        abs_path = os.path.abspath(image_path)
-        
-        commands = [
-            ["gsettings", "set", "org.gnome.desktop.background", "picture-uri", f"file://{abs_path}"],  # GNOME
-            ["feh", "--bg-scale", abs_path],  
-            ["nitrogen", "--set-scaled", abs_path]  
-        ]
-        
-        for cmd in commands:
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                if result.returncode == 0:
-                    return True
-            except FileNotFoundError:
-                continue
-        
-        return False
+        return desktop.set_wallpaper(image_path, timeout)
     except Exception as e:
-
         return False
 
-def set_wallpaper(image_path: str, delete_after: bool = True):
+@tracing.traced("wallpaper.set")
+def set_wallpaper(image_path: str, delete_after: bool = True, verify: bool = False,
+                  timeout: float = desktop.COMMAND_TIMEOUT):
     if not os.path.exists(image_path):
 
         return False
@@ -261,11 +249,11 @@ def set_wallpaper(image_path: str, delete_after: bool = True):
     
     try:
         if system == "Darwin":  # macOS
-            success = set_wallpaper_macos(image_path)
+            success = set_wallpaper_macos(image_path, verify, timeout)
         elif system == "Windows":
             success = set_wallpaper_windows(image_path)
         elif system == "Linux":
-            success = set_wallpaper_linux(image_path)
+            success = set_wallpaper_linux(image_path, timeout)
         else:
 
             return False
@@ -294,35 +282,28 @@ def set_wallpaper(image_path: str, delete_after: bool = True):
         return success
         
     except Exception as e:
+        tracing.error("wallpaper.set", e)
         return False
 
-def cleanup_old_wallpapers():
-    """清理旧的壁纸文件"""
+def create_and_set_wallpaper(message: str, profile: str = None, wait: bool = True):
+    """渲染（或从缓存取出）壁纸并设置
+    
+    wait 为 False 时渲染和设置都交给后台的壁纸线程，立即返回 Future；多次调用按提交顺序依次执行
+    """
+    global _dispatcher
+    if not wait:
+        if _dispatcher is None:
+            _dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wallpaper")
+        return _dispatcher.submit(create_and_set_wallpaper, message, profile)
+    
+    from wallpaper_cache import get_wallpaper
+    
     try:
-        current_dir = os.getcwd()
-        for filename in os.listdir(current_dir):
-            if filename.startswith("birthday_wallpaper_") and filename.endswith(".png"):
-                file_path = os.path.join(current_dir, filename)
-                if os.path.getctime(file_path) < time.time() - 3600:
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
+        # 直接按屏幕实际分辨率渲染，避免系统再缩放一次
+        wallpaper_path = get_wallpaper(message, profile, size=get_screen_size())
     except Exception as e:
-        pass  
-
-def create_and_set_wallpaper(message: str):
-    cleanup_old_wallpapers()
-    
-    wallpaper_path = create_wallpaper(message)
+        tracing.error("wallpaper.render", e)
+        return False
     
-    if os.path.exists(wallpaper_path):
-        success = set_wallpaper(wallpaper_path, delete_after=True)
-        if not success:
-            try:
-                os.remove(wallpaper_path)
-            except:
-                pass
-        return success
-    else:
-        return False 
\ No newline at end of file
+    # 缓存中的文件会被后续启动复用，设置后不删除，由缓存淘汰策略清理
+    return set_wallpaper(wallpaper_path, delete_after=False)
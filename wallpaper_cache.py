@@ -0,0 +1,96 @@
+"""
+壁纸内容寻址缓存
+底图内容、文字、字体、字号、尺寸和格式都没变时，直接复用上次生成的图片，跳过解码和编码
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import encoders
+import tracing
+from base_image import find_base_image
+from config import get_cache_dir, prune_cache_dir
+from screen import get_screen_size
+from wallpaper import FONT_SIZE, create_wallpaper, find_font_path
+
+MAX_CACHE_BYTES = 128 * 1024 * 1024
+MAX_AGE = 7 * 24 * 3600
+
+# (路径, mtime, 大小) -> 内容哈希，同一进程内不重复读取底图
+_digests = {}
+
+def file_digest(path: str) -> str:
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _digests.get(stamp)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _digests[stamp] = h.hexdigest()
+    return digest
+
+def wallpaper_key(message: str, base_digest, font_path, font_size: int, size, profile: str) -> str:
+    payload = json.dumps({
+        "base": base_digest,
+        "message": message,
+        "font": font_path,
+        "font_size": font_size,
+        "size": list(size),
+        "profile": profile,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_wallpaper(message: str, profile: str = None, size=None) -> str:
+    """返回渲染好的壁纸路径，命中缓存时不解码底图也不编码图片"""
+    start = time.perf_counter()
+    base_image_path = find_base_image()
+    if base_image_path is not None:
+        if size is None:
+            # 只读取文件头拿到尺寸
+            from PIL import Image
+            with Image.open(base_image_path) as image:
+                size = image.size
+        base_digest = file_digest(base_image_path)
+    else:
+        size = size or get_screen_size()
+        base_digest = None
+    
+    profile = encoders.DEFAULT_PROFILE if profile is None else profile
+    key = wallpaper_key(message, base_digest, find_font_path(message), FONT_SIZE, size, profile)
+    cache_dir = get_cache_dir("wallpapers")
+    path = os.path.join(cache_dir, key + encoders.extension(profile))
+    
+    if os.path.exists(path):
+        tracing.complete("wallpaper.cache_hit", start, time.perf_counter())
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+    
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        with tracing.span("wallpaper.render", size=list(size), profile=profile):
+            create_wallpaper(message, tmp_path, profile, size)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    
+    evict()
+    return path
+
+def evict(max_bytes: int = None, max_age: float = None):
+    """删除超过 MAX_AGE 未使用的壁纸，并按最近使用时间把总大小控制在上限内"""
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    max_age = MAX_AGE if max_age is None else max_age
+    prune_cache_dir(get_cache_dir("wallpapers"), encoders.all_extensions(), max_bytes, max_age)
@@ -0,0 +1,160 @@
+"""
+波表振荡器
+预先计算单周期波形表，用 32 位定点相位累加器读表并做线性插值，全程使用 float32；
+除正弦外还支持方波、锯齿波、三角波等音色，波表按音高限制谐波数，避免混叠
+
+与 audio.render_events 的正弦路径相比，误差不超过 TOLERANCE（满幅为 1），与音符长短无关：
+相位每 ANCHOR_SIZE 个采样按 float64 重新定位一次，定点增量的舍入误差不会随音符变长而累积
+"""
+
+import numpy as np
+
+import audio
+
+# 单周期波表长度（2 的幂，相位累加器的高位直接作为下标）
+TABLE_BITS = 11
+TABLE_SIZE = 1 << TABLE_BITS
+# 正弦音色相对 audio 正弦路径的最大绝对误差（约 -86 dBFS）
+TOLERANCE = 5e-5
+
+# 相位重新定位的间隔（采样数，2 的幂）；间隔内增量舍入造成的相位误差不超过 ANCHOR_SIZE / 2^33 周
+ANCHOR_BITS = 12
+ANCHOR_SIZE = 1 << ANCHOR_BITS
+
+_PHASE_SCALE = 2.0 ** 32
+_FRAC_SHIFT = 32 - TABLE_BITS
+_FRAC_MASK = (1 << _FRAC_SHIFT) - 1
+
+# 音色名 -> 由谐波序号（1, 2, 3, ...）计算各谐波 (sin 系数) 的函数
+TIMBRES = {}
+
+def register_timbre(name: str, harmonics):
+    TIMBRES[name] = harmonics
+
+def _only_first(h):
+    return (h == 1).astype(np.float64)
+
+def _square(h):
+    return np.where(h % 2 == 1, 1.0 / h, 0.0)
+
+def _saw(h):
+    return (-1.0) ** (h + 1) / h
+
+def _triangle(h):
+    return np.where(h % 2 == 1, (-1.0) ** ((h - 1) // 2) / h ** 2, 0.0)
+
+register_timbre("sine", _only_first)
+register_timbre("square", _square)
+register_timbre("saw", _saw)
+register_timbre("triangle", _triangle)
+
+def max_harmonics(freq: float, sample_rate: int) -> int:
+    """不超过奈奎斯特频率、且波表能表示的最高谐波数"""
+    return max(1, min(int(sample_rate / 2 // freq), TABLE_SIZE // 2 - 1))
+
+def get_table(timbre: str = "sine", harmonics: int = 1) -> np.ndarray:
+    """返回形状为 (2, TABLE_SIZE) 的只读 float32 表：波形值和到下一个点的差值（插值斜率）
+    
+    非正弦音色按 harmonics 做加法合成并归一化到峰值 1。
+    """
+    if timbre not in TIMBRES:
+        raise ValueError(f"未知的音色: {timbre}（可选: {', '.join(TIMBRES)}）")
+    if timbre == "sine":
+        harmonics = 1
+    
+    def build():
+        h = np.arange(1, harmonics + 1)
+        amplitude = TIMBRES[timbre](h)
+        x = 2 * np.pi * np.arange(TABLE_SIZE + 1) / TABLE_SIZE
+        wave = amplitude @ np.sin(np.outer(h, x))
+        wave /= np.abs(wave).max()
+        table = np.empty((2, TABLE_SIZE), dtype=np.float32)
+        table[0] = wave[:-1]
+        table[1] = np.diff(wave)
+        return table
+    
+    return audio.waveform_cache.get(("wavetable", timbre, harmonics, TABLE_SIZE), build)
+
+def oscillate(freq: float, out: np.ndarray, sample_rate: int = None, phase: float = 0.0,
+              start: int = 0, timbre: str = "sine") -> np.ndarray:
+    """把 sin(2π·freq·(start + k)/sample_rate + phase) 形状的波形写入 float32 的 out
+    
+    相位用 uint32 定点数累加，溢出即回绕；每 ANCHOR_SIZE 个采样的起点按 float64 算出精确相位，
+    增量的舍入误差只在一个间隔内累积，长音符的误差与短音符相同。
+    """
+    sample_rate = audio.SAMPLE_RATE if sample_rate is None else sample_rate
+    table = get_table(timbre, max_harmonics(freq, sample_rate))
+    n = out.size
+    
+    increment = round(freq / sample_rate * _PHASE_SCALE) % (1 << 32)
+    # 每个间隔起点的相位在 float64 下算好再量化，避免 k·increment 的误差随 k 增长
+    anchor = start + np.arange(0, n, ANCHOR_SIZE)
+    first = np.mod(phase / (2 * np.pi) + freq / sample_rate * anchor, 1.0)
+    first = (first * _PHASE_SCALE).astype(np.uint64).astype(np.uint32)
+    acc = np.arange(n, dtype=np.uint32)
+    acc &= np.uint32(ANCHOR_SIZE - 1)
+    acc *= np.uint32(increment)
+    acc += np.repeat(first, ANCHOR_SIZE)[:n]
+    
+    index = acc >> np.uint32(_FRAC_SHIFT)
+    frac = (acc & np.uint32(_FRAC_MASK)).astype(np.float32)
+    frac *= np.float32(1.0 / (1 << _FRAC_SHIFT))
+    
+    np.take(table[1], index, out=out)
+    out *= frac
+    out += table[0].take(index)
+    return out
+
+def render_events(events: audio.SongEvents, out: np.ndarray, offset: int = 0,
+                  timbre: str = "sine") -> np.ndarray:
+    """与 audio.render_events 相同的接口，用波表振荡器渲染"""
+    end = offset + out.size
+    first = np.searchsorted(events.end, offset, side="right")
+    last = np.searchsorted(events.start, end, side="left")
+    volume = np.float32(audio.VOLUME)
+    
+    for i in range(first, last):
+        note_start = int(events.start[i])
+        note_len = int(events.length[i])
+        lo = max(note_start, offset)
+        hi = min(note_start + note_len, end)
+        seg = out[lo - offset:hi - offset]
+        
+        if events.freq[i] == 0:
+            seg[:] = 0
+            continue
+        
+        a = lo - note_start
+        oscillate(float(events.freq[i]), seg, events.sample_rate, events.phase[i], a, timbre)
+        # 与 audio.note_waveform 相同的包络（线性衰减和首尾淡入淡出）
+        seg *= audio.envelope(note_len, events.sample_rate, a, hi - note_start).astype(np.float32)
+        seg *= volume
+    
+    return out
+
+def benchmark(bpm: int = 90, repeat: int = 5, sample_rates=(44_100, 96_000)):
+    """整首歌的渲染耗时（冷缓存）和与正弦路径的最大误差"""
+    import time
+    
+    results = {}
+    for sample_rate in sample_rates:
+        events = audio.compile_melody(bpm, sample_rate=sample_rate)
+        reference = audio.render_events(events, np.empty(events.total, dtype=np.float32))
+        row = {}
+        for name, render in (("sine", audio.render_events),
+                             ("wavetable", lambda e, o: render_events(e, o))):
+            best = float("inf")
+            for _ in range(repeat):
+                audio.waveform_cache.clear()
+                out = np.empty(events.total, dtype=np.float32)
+                start = time.perf_counter()
+                render(events, out)
+                best = min(best, time.perf_counter() - start)
+            row[name] = {"seconds": best, "max_error": float(np.abs(out - reference).max())}
+        results[sample_rate] = row
+        print(f"{sample_rate} Hz: " + "  ".join(
+            f"{name}={r['seconds'] * 1000:.1f}ms (误差 {r['max_error']:.1e})" for name, r in row.items()))
+    return results
+
+if __name__ == "__main__":
+    benchmark()